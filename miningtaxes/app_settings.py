@@ -21,6 +21,39 @@ MININGTAXES_TASKS_OBJECT_CACHE_TIMEOUT = clean_setting(
 MININGTAXES_TASKS_TIME_LIMIT = clean_setting("MININGTAXES_TASKS_TIME_LIMIT", 7200)
 """Global timeout for tasks in seconds to reduce task accumulation during outages."""
 
+MININGTAXES_UPDATE_CHUNK_SIZE = clean_setting(
+    "MININGTAXES_UPDATE_CHUNK_SIZE", 50, min_value=1
+)
+"""Number of characters updated by each subtask of the daily update."""
+
+MININGTAXES_UPDATE_CONCURRENCY = clean_setting(
+    "MININGTAXES_UPDATE_CONCURRENCY", 4, min_value=1
+)
+"""Maximum number of subtasks of the daily update running in parallel."""
+
+MININGTAXES_OBSERVER_CONCURRENCY = clean_setting(
+    "MININGTAXES_OBSERVER_CONCURRENCY", 5, min_value=1
+)
+"""Maximum number of mining observers fetched from ESI in parallel."""
+
+MININGTAXES_STRUCTURE_CACHE_TIMEOUT = clean_setting(
+    "MININGTAXES_STRUCTURE_CACHE_TIMEOUT", 86400
+)
+"""Seconds the name and location of a mining observer structure are cached."""
+
+MININGTAXES_STRUCTURE_ERROR_CACHE_TIMEOUT = clean_setting(
+    "MININGTAXES_STRUCTURE_ERROR_CACHE_TIMEOUT", 604800
+)
+"""Seconds a structure that could not be accessed (403/404) is not looked up again."""
+
+MININGTAXES_ETAG_CACHE_TIMEOUT = clean_setting("MININGTAXES_ETAG_CACHE_TIMEOUT", 604800)
+"""Seconds the ETag of an ESI response is kept for conditional requests."""
+
+MININGTAXES_BALANCE_CACHE_TIMEOUT = clean_setting(
+    "MININGTAXES_BALANCE_CACHE_TIMEOUT", 86400
+)
+"""Seconds the tax balance of a user is cached unless it changes before."""
+
 MININGTAXES_REFINED_RATE = clean_setting("MININGTAXES_REFINED_RATE", 0.9063)
 """Refining rate for ores."""
 
@@ -35,3 +68,16 @@ MININGTAXES_PRICE_SOURCE_NAME = clean_setting("MININGTAXES_PRICE_SOURCE_NAME", "
 MININGTAXES_PRICE_METHOD = clean_setting("MININGTAXES_PRICE_METHOD", "Fuzzwork")
 
 MININGTAXES_PRICE_JANICE_API_KEY = clean_setting("MININGTAXES_PRICE_JANICE_API_KEY", "")
+
+MININGTAXES_PRICE_TIMEOUT = clean_setting("MININGTAXES_PRICE_TIMEOUT", 30, min_value=1)
+"""Timeout in seconds for requests to the pricing API."""
+
+MININGTAXES_PRICE_CONCURRENCY = clean_setting(
+    "MININGTAXES_PRICE_CONCURRENCY", 4, min_value=1
+)
+"""Maximum number of requests to the pricing API running in parallel."""
+
+MININGTAXES_PRICE_MAX_RETRIES = clean_setting(
+    "MININGTAXES_PRICE_MAX_RETRIES", 3, min_value=0
+)
+"""Number of times a failed request to the pricing API is retried."""
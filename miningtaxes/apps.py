@@ -7,3 +7,6 @@ class MiningTaxesConfig(AppConfig):
     name = "miningtaxes"
     label = "miningtaxes"
     verbose_name = f"Mining Taxes v{__version__}"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -60,14 +60,11 @@ def fetch_character_if_allowed(*args_select_related):
         @wraps(view_func)
         def _wrapped_view(request, character_pk, *args, **kwargs):
             try:
-                args_select_related_2 = args_select_related + (
-                    "eve_character",
-                    "eve_character__character_ownership__user",
-                    "eve_character__character_ownership__user__profile__main_character",
+                character = (
+                    Character.objects.with_owner_graph()
+                    .select_related(*args_select_related)
+                    .get(pk=character_pk)
                 )
-                character = Character.objects.select_related(
-                    *args_select_related_2
-                ).get(pk=character_pk)
             except Character.DoesNotExist:
                 return HttpResponseNotFound()
 
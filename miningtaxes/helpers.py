@@ -1,7 +1,41 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import models
 from eveuniverse.models import EveType
 
 
+def to_date(value):
+    """Convert a date or datetime from ESI into a date."""
+    return models.DateField().to_python(value)
+
+
+def bulk_get_or_create_esi(model, ids) -> dict:
+    """Fetch eveuniverse objects for many ids with one query
+    and load only the missing ones from ESI.
+
+    Returns a dict of objects keyed by id.
+    """
+    objs = model.objects.in_bulk(set(ids))
+    missing_ids = set(ids) - objs.keys()
+    for missing_id in missing_ids:
+        objs[missing_id], _ = model.objects.get_or_create_esi(id=missing_id)
+    if missing_ids and model is EveType:
+        PriceGroups.invalidate()
+    return objs
+
+
 class PriceGroups:
+    """Types of all priced groups and their tax groups.
+
+    Use load() to get a registry that is only built once per process
+    and rebuilt after invalidate() was called in any process.
+    """
+
+    _CACHE_VERSION_KEY = "miningtaxes-price-groups-version"
+    _instance = None
+    _version = None
+
     moon_ore_groups = (
         1923,  # R64 Moon ores
         1922,  # R32 Moon ores
@@ -82,15 +116,35 @@ class PriceGroups:
     }
 
     def __init__(self):
-        self.items = []
-        added = set()
-        for grp in self.groups:
-            g = EveType.objects.filter(eve_group_id=grp)
-            for it in g:
-                if it.id in added:
-                    continue
-                added.add(it.id)
-                self.items.append(it)
-        self.taxable_groups = set()
-        for k in self.taxgroups.keys():
-            self.taxable_groups.add(self.taxgroups[k])
+        self.items = list(
+            EveType.objects.filter(eve_group_id__in=self.groups).order_by("id")
+        )
+        self.taxable_groups = set(self.taxgroups.values())
+        self.type_taxgroups = {
+            type_id: self.taxgroups[group_id]
+            for type_id, group_id in EveType.objects.filter(
+                eve_group_id__in=self.taxgroups.keys()
+            ).values_list("id", "eve_group_id")
+        }
+        self.moon_ore_type_ids = {
+            item.id for item in self.items if item.eve_group_id in self.moon_ore_groups
+        }
+
+    @classmethod
+    def load(cls) -> "PriceGroups":
+        """Return the registry, building it only when it has been invalidated."""
+        version = cache.get_or_set(
+            cls._CACHE_VERSION_KEY, lambda: uuid4().hex, timeout=None
+        )
+        if cls._instance is None or cls._version != version:
+            cls._instance = cls()
+            cls._version = version
+        return cls._instance
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """Rebuild the registry of all processes on next load,
+        e.g. after new types have been loaded.
+        """
+        cache.set(cls._CACHE_VERSION_KEY, uuid4().hex, timeout=None)
+        cls._instance = None
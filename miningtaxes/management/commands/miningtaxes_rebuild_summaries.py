@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from ...models.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recalculates all monthly summaries from the mining ledgers and tax credits"
+
+    def handle(self, *args, **options):
+        rebuild_summaries()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from ...tasks import update_static_data
+
+
+class Command(BaseCommand):
+    help = "Reloads types and materials of all ores from ESI, e.g. after a game patch"
+
+    def handle(self, *args, **options):
+        update_static_data(force_update=True)
@@ -1,10 +1,10 @@
 from django.core.management.base import BaseCommand
 
-from ...tasks import update_daily
+from ...tasks import update_daily_serial
 
 
 class Command(BaseCommand):
     help = "Runs daily update manually"
 
     def handle(self, *args, **options):
-        update_daily()
+        update_daily_serial()
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0010_stats_admin_get_all_activity_json"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="adminminingobservers",
+            name="content_hash",
+            field=models.CharField(default="", max_length=32),
+        ),
+    ]
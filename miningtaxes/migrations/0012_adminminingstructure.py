@@ -0,0 +1,53 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eveuniverse", "0010_alter_eveindustryactivityduration_eve_type_and_more"),
+        ("miningtaxes", "0011_adminminingobservers_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdminMiningStructure",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("structure_id", models.BigIntegerField(unique=True)),
+                ("name", models.CharField(default="", max_length=100)),
+                (
+                    "error_status",
+                    models.PositiveSmallIntegerField(
+                        default=None,
+                        help_text="HTTP status of the last lookup if the structure was not accessible",
+                        null=True,
+                    ),
+                ),
+                ("fetched_at", models.DateTimeField()),
+                (
+                    "eve_solar_system",
+                    models.ForeignKey(
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="eveuniverse.evesolarsystem",
+                    ),
+                ),
+            ],
+            options={
+                "default_permissions": (),
+            },
+        ),
+    ]
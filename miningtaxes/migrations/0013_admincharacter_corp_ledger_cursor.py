@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0012_adminminingstructure"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="admincharacter",
+            name="corp_ledger_corporation_id",
+            field=models.BigIntegerField(
+                default=None,
+                help_text="Corporation of the last processed wallet journal entry",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="admincharacter",
+            name="corp_ledger_last_date",
+            field=models.DateTimeField(
+                default=None,
+                help_text="Date of the last processed wallet journal entry",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="admincharacter",
+            name="corp_ledger_last_id",
+            field=models.BigIntegerField(
+                default=None,
+                help_text="ID of the last processed wallet journal entry",
+                null=True,
+            ),
+        ),
+    ]
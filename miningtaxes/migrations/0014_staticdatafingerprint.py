@@ -0,0 +1,35 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eveuniverse", "0010_alter_eveindustryactivityduration_eve_type_and_more"),
+        ("miningtaxes", "0013_admincharacter_corp_ledger_cursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StaticDataFingerprint",
+            fields=[
+                (
+                    "eve_type",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="eveuniverse.evetype",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=32)),
+                ("loaded_at", models.DateTimeField()),
+            ],
+            options={
+                "default_permissions": (),
+            },
+        ),
+    ]
@@ -0,0 +1,168 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Min, Sum
+from django.db.models.functions import TruncMonth
+
+from miningtaxes.helpers import PriceGroups
+
+
+def month_of(value):
+    if hasattr(value, "date"):
+        value = value.date()
+    return value.replace(day=1)
+
+
+def fill_summaries(apps, schema_editor):
+    CharacterMiningLedgerEntry = apps.get_model(
+        "miningtaxes", "CharacterMiningLedgerEntry"
+    )
+    CharacterTaxCredits = apps.get_model("miningtaxes", "CharacterTaxCredits")
+    CharacterMonthlySummary = apps.get_model("miningtaxes", "CharacterMonthlySummary")
+    SystemMonthlySummary = apps.get_model("miningtaxes", "SystemMonthlySummary")
+
+    characters = {}
+    for row in (
+        CharacterMiningLedgerEntry.objects.annotate(month=TruncMonth("date"))
+        .values("character_id", "month")
+        .annotate(
+            quantity_total=Sum("quantity"),
+            taxed_value_total=Sum("taxed_value"),
+            taxes_owed_total=Sum("taxes_owed"),
+        )
+    ):
+        key = (row["character_id"], month_of(row["month"]))
+        characters[key] = CharacterMonthlySummary(
+            character_id=key[0],
+            month=key[1],
+            quantity=row["quantity_total"],
+            taxed_value=row["taxed_value_total"],
+            taxes_owed=row["taxes_owed_total"],
+        )
+    for row in (
+        CharacterTaxCredits.objects.annotate(month=TruncMonth("date"))
+        .values("character_id", "month")
+        .annotate(credits_total=Sum("credit"))
+    ):
+        key = (row["character_id"], month_of(row["month"]))
+        if key not in characters:
+            characters[key] = CharacterMonthlySummary(character_id=key[0], month=key[1])
+        characters[key].credits = row["credits_total"]
+    CharacterMonthlySummary.objects.bulk_create(characters.values(), batch_size=500)
+
+    systems = {}
+    for row in (
+        CharacterMiningLedgerEntry.objects.annotate(month=TruncMonth("date"))
+        .values("eve_solar_system_id", "month", "eve_type__eve_group_id")
+        .annotate(
+            quantity_total=Sum("quantity"),
+            taxed_value_total=Sum("taxed_value"),
+            taxes_owed_total=Sum("taxes_owed"),
+            first_date=Min("date"),
+        )
+    ):
+        tax_group = PriceGroups.taxgroups.get(row["eve_type__eve_group_id"])
+        if tax_group is None:
+            continue
+        key = (row["eve_solar_system_id"], tax_group, month_of(row["month"]))
+        if key not in systems:
+            systems[key] = SystemMonthlySummary(
+                eve_solar_system_id=key[0],
+                tax_group=key[1],
+                month=key[2],
+                first_date=row["first_date"],
+            )
+        obj = systems[key]
+        obj.quantity += row["quantity_total"]
+        obj.taxed_value += row["taxed_value_total"]
+        obj.taxes_owed += row["taxes_owed_total"]
+        obj.first_date = min(obj.first_date, row["first_date"])
+    SystemMonthlySummary.objects.bulk_create(systems.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eveuniverse", "0010_alter_eveindustryactivityduration_eve_type_and_more"),
+        ("miningtaxes", "0014_staticdatafingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SystemMonthlySummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tax_group", models.CharField(max_length=32)),
+                ("month", models.DateField(db_index=True)),
+                ("quantity", models.BigIntegerField(default=0)),
+                ("taxed_value", models.FloatField(default=0.0)),
+                ("taxes_owed", models.FloatField(default=0.0)),
+                ("first_date", models.DateField()),
+                (
+                    "eve_solar_system",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="eveuniverse.evesolarsystem",
+                    ),
+                ),
+            ],
+            options={
+                "default_permissions": (),
+            },
+        ),
+        migrations.CreateModel(
+            name="CharacterMonthlySummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(db_index=True)),
+                ("quantity", models.BigIntegerField(default=0)),
+                ("taxed_value", models.FloatField(default=0.0)),
+                ("taxes_owed", models.FloatField(default=0.0)),
+                ("credits", models.FloatField(default=0.0)),
+                (
+                    "character",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_summaries",
+                        to="miningtaxes.character",
+                    ),
+                ),
+            ],
+            options={
+                "default_permissions": (),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="systemmonthlysummary",
+            constraint=models.UniqueConstraint(
+                fields=("eve_solar_system", "tax_group", "month"),
+                name="functional_pk_mt_systemmonthlysummary",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="charactermonthlysummary",
+            constraint=models.UniqueConstraint(
+                fields=("character", "month"),
+                name="functional_pk_mt_charactermonthlysummary",
+            ),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
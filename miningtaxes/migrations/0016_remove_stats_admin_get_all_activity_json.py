@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0015_monthly_summaries"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="stats",
+            name="admin_get_all_activity_json",
+        ),
+    ]
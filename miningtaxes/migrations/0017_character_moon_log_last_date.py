@@ -0,0 +1,22 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0016_remove_stats_admin_get_all_activity_json"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="character",
+            name="moon_log_last_date",
+            field=models.DateField(
+                default=None,
+                help_text="Date of the last moon observer log entry added to the mining ledger",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0017_character_moon_log_last_date"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="character",
+            name="life_credits_updated_at",
+            field=models.DateTimeField(
+                default=None,
+                help_text="When life_credits was last calculated",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="character",
+            name="life_taxes_updated_at",
+            field=models.DateTimeField(
+                default=None, help_text="When life_taxes was last calculated", null=True
+            ),
+        ),
+    ]
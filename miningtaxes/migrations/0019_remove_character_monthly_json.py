@@ -0,0 +1,25 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0018_character_lifetime_updated_at"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="character",
+            name="monthly_credits_json",
+        ),
+        migrations.RemoveField(
+            model_name="character",
+            name="monthly_mining_json",
+        ),
+        migrations.RemoveField(
+            model_name="character",
+            name="monthly_taxes_json",
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("miningtaxes", "0019_remove_character_monthly_json"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="character",
+            name="moon_log_last_date",
+        ),
+        migrations.AddField(
+            model_name="adminminingobslog",
+            name="updated_at",
+            field=models.DateTimeField(
+                db_index=True,
+                default=django.utils.timezone.now,
+                help_text="When this entry was last stored",
+            ),
+        ),
+        migrations.AddField(
+            model_name="character",
+            name="moon_log_updated_at",
+            field=models.DateTimeField(
+                default=None,
+                help_text="Moon observer log entries stored after this time are not yet added to the mining ledger",
+                null=True,
+            ),
+        ),
+    ]
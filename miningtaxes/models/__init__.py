@@ -2,6 +2,7 @@ from .admin import (  # noqa: F401
     AdminCharacter,
     AdminMiningCorpLedgerEntry,
     AdminMiningObsLog,
+    AdminMiningStructure,
 )
 from .character import (  # noqa: F401
     Character,
@@ -9,6 +10,14 @@ from .character import (  # noqa: F401
     CharacterUpdateStatus,
 )
 from .general import General  # noqa: F401
-from .orePrices import OrePrices, get_price, get_tax, ore_calc_prices  # noqa: F401
+from .orePrices import (  # noqa: F401
+    OrePrices,
+    PriceTable,
+    StaticDataFingerprint,
+    get_price,
+    get_tax,
+    ore_calc_prices,
+)
 from .settings import Settings  # noqa: F401
 from .stats import Stats  # noqa: F401
+from .summaries import CharacterMonthlySummary, SystemMonthlySummary  # noqa: F401
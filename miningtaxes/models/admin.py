@@ -1,5 +1,16 @@
 # Shamelessly stolen from Member Audit
+import datetime as dt
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from bravado.exception import HTTPForbidden, HTTPNotFound
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Exists, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 from esi.models import Token
 from eveuniverse.models import EveSolarSystem, EveType
 
@@ -8,13 +19,29 @@ from allianceauth.services.hooks import get_extension_logger
 from app_utils.logging import LoggerAddTag
 
 from .. import __title__
-from ..app_settings import MININGTAXES_TAX_ONLY_CORP_MOONS
+from ..app_settings import (
+    MININGTAXES_OBSERVER_CONCURRENCY,
+    MININGTAXES_STRUCTURE_CACHE_TIMEOUT,
+    MININGTAXES_STRUCTURE_ERROR_CACHE_TIMEOUT,
+    MININGTAXES_TAX_ONLY_CORP_MOONS,
+)
 from ..decorators import fetch_token_for_character
-from ..providers import esi
-from .character import CharacterAbstract
+from ..helpers import bulk_get_or_create_esi, to_date
+from ..providers import esi, esi_results_if_modified, store_etag
+from .character import (
+    Character,
+    CharacterAbstract,
+    CharacterMiningLedgerEntry,
+    CharacterTaxCredits,
+    credits_changed,
+)
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
+# log entries are timestamped before they are committed,
+# so recent ones are processed again in case a slower write committed late
+MOON_LOG_WATERMARK_OVERLAP = dt.timedelta(minutes=10)
+
 
 class AdminCharacter(CharacterAbstract):
     eve_character = models.OneToOneField(
@@ -22,6 +49,21 @@ class AdminCharacter(CharacterAbstract):
         related_name="miningtaxes_admin_character",
         on_delete=models.CASCADE,
     )
+    corp_ledger_corporation_id = models.BigIntegerField(
+        null=True,
+        default=None,
+        help_text="Corporation of the last processed wallet journal entry",
+    )
+    corp_ledger_last_id = models.BigIntegerField(
+        null=True,
+        default=None,
+        help_text="ID of the last processed wallet journal entry",
+    )
+    corp_ledger_last_date = models.DateTimeField(
+        null=True,
+        default=None,
+        help_text="Date of the last processed wallet journal entry",
+    )
 
     @classmethod
     def get_esi_scopes(cls) -> list:
@@ -37,90 +79,307 @@ class AdminCharacter(CharacterAbstract):
         self.update_corp_ledger()
         return
 
+    def _etag_key(self, endpoint: str, corporation_id: int) -> str:
+        """Cache key for the ETag of a corporation endpoint.
+
+        Keys are per admin character, since each one keeps its own observers
+        and journal position, which a response cached for another admin
+        character of the same corporation would leave behind.
+        """
+        return f"miningtaxes-etag-{endpoint}-{corporation_id}-{self.pk}"
+
     @fetch_token_for_character(
         ("esi-industry.read_corporation_mining.v1", "esi-universe.read_structures.v1")
     )
     def update_mining_observers(self, token: Token):
         logger.info("%s: Fetching mining observers from ESI", self)
-        # get_corporation_corporation_id_mining_observers
-        entries = esi.client.Industry.get_corporation_corporation_id_mining_observers(
-            corporation_id=self.eve_character.corporation_id,
+        corporation_id = self.eve_character.corporation_id
+        observers_etag_key = self._etag_key("mining-observers", corporation_id)
+        entries, observers_etag = esi_results_if_modified(
+            esi.client.Industry.get_corporation_corporation_id_mining_observers,
+            etag_key=observers_etag_key,
+            corporation_id=corporation_id,
             token=token.valid_access_token(),
-        ).results()
-        for entry in entries:
-            structinfo = None
-            try:
-                structinfo = esi.client.Universe.get_universe_structures_structure_id(
-                    structure_id=entry["observer_id"],
-                    token=token.valid_access_token(),
-                ).results()
-            except Exception as e:
-                logger.error(
-                    f"Unknown struct id. Most likely offlined/old struct, ignoring: {entry['observer_id']}"
-                )
-                logger.error(e)
-                pass
-            if structinfo is None:
-                continue
-            structname = ""
-            sys = None
-            if type(structinfo) == dict:
-                structname = structinfo["name"][0:32]  # fix for names too long
-                sys, _ = EveSolarSystem.objects.get_or_create_esi(
-                    id=structinfo["solar_system_id"]
+        )
+        observers_modified = entries is not None
+        if not observers_modified:
+            # later mining on an already listed day only changes the observer logs
+            logger.info("%s: Mining observers have not changed", self)
+            entries = [
+                {"observer_id": obs.obs_id, "observer_type": obs.obs_type}
+                for obs in self.mining_obs.all()
+            ]
+        access_token = token.valid_access_token()
+        structures = AdminMiningStructure.objects.fetch(
+            [entry["observer_id"] for entry in entries], access_token
+        )
+
+        def fetch_observer(entry):
+            etag_key = self._etag_key(
+                f"mining-observer-{entry['observer_id']}", corporation_id
+            )
+            ledger, etag = esi_results_if_modified(
+                esi.client.Industry.get_corporation_corporation_id_mining_observers_observer_id,
+                etag_key=etag_key,
+                corporation_id=corporation_id,
+                observer_id=entry["observer_id"],
+                token=access_token,
+            )
+            return entry, structures[entry["observer_id"]], ledger, etag_key, etag
+
+        with ThreadPoolExecutor(
+            max_workers=MININGTAXES_OBSERVER_CONCURRENCY
+        ) as executor:
+            results = [
+                result
+                for result in executor.map(
+                    fetch_observer,
+                    [entry for entry in entries if entry["observer_id"] in structures],
                 )
-            else:
-                logger.error("Wrong struct info for: %d" % entry["observer_id"])
-                logger.error(structinfo)
-                continue
+                if result[2] is not None
+            ]
 
+        bulk_get_or_create_esi(
+            EveType,
+            {line["type_id"] for _, _, ledger, _, _ in results for line in ledger},
+        )
+        for entry, structure, ledger, etag_key, etag in results:
+            sys = structure.eve_solar_system
             (obs, _) = self.mining_obs.update_or_create(
                 obs_id=entry["observer_id"],
                 defaults={
                     "obs_type": entry["observer_type"],
                     "sys_name": sys.name,
-                    "name": structname,
+                    "name": structure.name[0:32],  # fix for names too long
                 },
             )
-            ledger = esi.client.Industry.get_corporation_corporation_id_mining_observers_observer_id(
-                corporation_id=self.eve_character.corporation_id,
-                observer_id=entry["observer_id"],
-                token=token.valid_access_token(),
-            ).results()
+            content_hash = hashlib.md5(
+                json.dumps(ledger, cls=DjangoJSONEncoder).encode("utf-8")
+            ).hexdigest()
+            if content_hash == obs.content_hash:
+                logger.debug("%s: No changes for observer %s", self, obs.obs_id)
+                store_etag(etag_key, etag)
+                continue
+            quantities = {}
             for line in ledger:
-                eve_type, _ = EveType.objects.get_or_create_esi(id=line["type_id"])
-                obs.mining_log.update_or_create(
-                    miner_id=line["character_id"],
-                    date=line["last_updated"],
-                    eve_type=eve_type,
-                    defaults={
-                        "eve_solar_system": sys,
-                        "quantity": line["quantity"],
-                    },
+                key = (
+                    to_date(line["last_updated"]),
+                    line["character_id"],
+                    line["type_id"],
                 )
+                quantities[key] = line["quantity"]
+            AdminMiningObsLog.objects.bulk_upsert(obs, sys, quantities)
+            obs.content_hash = content_hash
+            obs.save(update_fields=["content_hash"])
+            store_etag(etag_key, etag)
+        if observers_modified:
+            store_etag(observers_etag_key, observers_etag)
 
     @fetch_token_for_character("esi-wallet.read_corporation_wallets.v1")
     def update_corp_ledger(self, token: Token):
-        """Update corp ledger from ESI for this character."""
+        """Update corp ledger from ESI for this character.
+
+        Only journal entries newer than the last processed entry are stored.
+        """
         logger.info("%s: Fetching corp wallet ledger from ESI", self)
-        entries = (
-            esi.client.Wallet.get_corporations_corporation_id_wallets_division_journal(
-                corporation_id=self.eve_character.corporation_id,
-                division=1,
-                token=token.valid_access_token(),
-            ).results()
+        corporation_id = self.eve_character.corporation_id
+        etag_key = self._etag_key("corp-journal", corporation_id)
+        entries, etag = esi_results_if_modified(
+            esi.client.Wallet.get_corporations_corporation_id_wallets_division_journal,
+            etag_key=etag_key,
+            corporation_id=corporation_id,
+            division=1,
+            token=token.valid_access_token(),
         )
-        for entry in entries:
-            if entry["ref_type"] != "player_donation":
-                continue
-            self.corp_ledger.update_or_create(
+        if entries is None:
+            logger.info("%s: Corp wallet journal has not changed", self)
+            return
+        last_id = (
+            self.corp_ledger_last_id
+            if self.corp_ledger_corporation_id == corporation_id
+            else None
+        )
+        entries = [
+            entry for entry in entries if last_id is None or entry["id"] > last_id
+        ]
+        if not entries:
+            logger.info("%s: No new corp wallet journal entries", self)
+            store_etag(etag_key, etag)
+            return
+        donations = [
+            AdminMiningCorpLedgerEntry(
+                character=self,
                 taxed_id=entry["first_party_id"],
                 date=entry["date"],
-                defaults={
-                    "amount": entry["amount"],
-                    "reason": entry["reason"][0:32],
-                },
+                amount=entry["amount"],
+                reason=entry["reason"][0:32],
+            )
+            for entry in entries
+            if entry["ref_type"] == "player_donation"
+        ]
+        AdminMiningCorpLedgerEntry.objects.bulk_create(
+            donations, batch_size=500, ignore_conflicts=True
+        )
+        logger.info(
+            "%s: Processed %d new corp wallet journal entries with %d donations",
+            self,
+            len(entries),
+            len(donations),
+        )
+        newest = max(entries, key=lambda entry: entry["id"])
+        self.corp_ledger_corporation_id = corporation_id
+        self.corp_ledger_last_id = newest["id"]
+        self.corp_ledger_last_date = newest["date"]
+        self.save(
+            update_fields=[
+                "corp_ledger_corporation_id",
+                "corp_ledger_last_id",
+                "corp_ledger_last_date",
+            ]
+        )
+        store_etag(etag_key, etag)
+
+
+class AdminMiningStructureManager(models.Manager):
+    def fetch(self, structure_ids, access_token: str) -> dict:
+        """Return accessible structures for the given IDs keyed by structure ID.
+
+        Stored structures are used until they are stale. Unknown and stale
+        structures are fetched from ESI in parallel. Structures that return
+        403 or 404 are remembered as inaccessible and not looked up again
+        until they are stale.
+        """
+        structures = self.select_related("eve_solar_system").in_bulk(
+            set(structure_ids), field_name="structure_id"
+        )
+        stale_ids = [
+            structure_id
+            for structure_id in set(structure_ids)
+            if structure_id not in structures or structures[structure_id].is_stale
+        ]
+        if stale_ids:
+            logger.info("Fetching %d structures from ESI", len(stale_ids))
+            with ThreadPoolExecutor(
+                max_workers=MININGTAXES_OBSERVER_CONCURRENCY
+            ) as executor:
+                responses = dict(
+                    zip(
+                        stale_ids,
+                        executor.map(
+                            lambda structure_id: self._fetch_from_esi(
+                                structure_id, access_token
+                            ),
+                            stale_ids,
+                        ),
+                    )
+                )
+            structures.update(self._update_from_esi(structures, responses))
+        return {
+            structure_id: structure
+            for structure_id, structure in structures.items()
+            if structure.is_accessible
+        }
+
+    def _update_from_esi(self, structures: dict, responses: dict) -> dict:
+        systems = bulk_get_or_create_esi(
+            EveSolarSystem,
+            {
+                structinfo["solar_system_id"]
+                for _, structinfo in responses.values()
+                if structinfo is not None
+            },
+        )
+        fetched_at = now()
+        tocreate = []
+        toupdate = []
+        for structure_id, (error_status, structinfo) in responses.items():
+            if error_status is None and structinfo is None:
+                continue  # temporary error, keep what we know
+            structure = structures.get(structure_id)
+            if structure is None:
+                structure = self.model(structure_id=structure_id)
+                tocreate.append(structure)
+            else:
+                toupdate.append(structure)
+            structure.error_status = error_status
+            structure.fetched_at = fetched_at
+            if structinfo is not None:
+                structure.name = structinfo["name"]
+                structure.eve_solar_system = systems[structinfo["solar_system_id"]]
+        self.bulk_create(tocreate)
+        self.bulk_update(
+            toupdate, ["name", "eve_solar_system", "error_status", "fetched_at"]
+        )
+        return {structure.structure_id: structure for structure in tocreate + toupdate}
+
+    @staticmethod
+    def _fetch_from_esi(structure_id: int, access_token: str):
+        """Fetch a structure from ESI.
+
+        Returns:
+        - (None, structure info) if successful
+        - (HTTP status, None) if the structure is not accessible
+        - (None, None) for any other error
+        """
+        try:
+            structinfo = esi.client.Universe.get_universe_structures_structure_id(
+                structure_id=structure_id,
+                token=access_token,
+            ).results()
+        except (HTTPForbidden, HTTPNotFound) as e:
+            logger.warning(
+                f"Unknown struct id. Most likely offlined/old struct, ignoring: {structure_id}"
             )
+            return e.status_code, None
+        except Exception as e:
+            logger.error(f"Failed to fetch struct id {structure_id}: {e}")
+            return None, None
+        if not isinstance(structinfo, dict):
+            logger.error("Wrong struct info for: %d" % structure_id)
+            logger.error(structinfo)
+            return None, None
+        return None, structinfo
+
+
+class AdminMiningStructure(models.Model):
+    """Name and location of a structure hosting a mining observer."""
+
+    structure_id = models.BigIntegerField(unique=True)
+    name = models.CharField(max_length=100, default="")
+    eve_solar_system = models.ForeignKey(
+        EveSolarSystem,
+        on_delete=models.SET_NULL,
+        null=True,
+        default=None,
+        related_name="+",
+    )
+    error_status = models.PositiveSmallIntegerField(
+        null=True,
+        default=None,
+        help_text="HTTP status of the last lookup if the structure was not accessible",
+    )
+    fetched_at = models.DateTimeField()
+
+    objects = AdminMiningStructureManager()
+
+    class Meta:
+        default_permissions = ()
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.structure_id})"
+
+    @property
+    def is_accessible(self) -> bool:
+        return self.error_status is None and self.eve_solar_system_id is not None
+
+    @property
+    def is_stale(self) -> bool:
+        timeout = (
+            MININGTAXES_STRUCTURE_CACHE_TIMEOUT
+            if self.error_status is None
+            else MININGTAXES_STRUCTURE_ERROR_CACHE_TIMEOUT
+        )
+        return (now() - self.fetched_at).total_seconds() > timeout
 
 
 class AdminMiningObservers(models.Model):
@@ -133,6 +392,7 @@ class AdminMiningObservers(models.Model):
     obs_type = models.CharField(max_length=32)
     name = models.CharField(max_length=32)
     sys_name = models.CharField(max_length=32)
+    content_hash = models.CharField(max_length=32, default="")
 
     class Meta:
         default_permissions = ()
@@ -147,6 +407,137 @@ class AdminMiningObservers(models.Model):
         return f"{self.character} miningObs {self.id}"
 
 
+class AdminMiningObsLogManager(models.Manager):
+    def bulk_upsert(self, observer, eve_solar_system, quantities: dict) -> list:
+        """Create or update many log entries of an observer at once.
+
+        Args:
+        - observer: Observer the entries belong to
+        - eve_solar_system: Solar system of the observer
+        - quantities: Quantities keyed by (date, miner ID, type ID)
+
+        Returns:
+        - Created and updated entries
+        """
+        if not quantities:
+            return []
+        existing = {
+            (entry.date, entry.miner_id, entry.eve_type_id): entry
+            for entry in observer.mining_log.filter(
+                date__in={date for date, _, _ in quantities.keys()}
+            )
+        }
+        updated_at = now()
+        tocreate = []
+        toupdate = []
+        for (date, miner_id, eve_type_id), quantity in quantities.items():
+            entry = existing.get((date, miner_id, eve_type_id))
+            if entry is None:
+                tocreate.append(
+                    self.model(
+                        observer=observer,
+                        date=date,
+                        miner_id=miner_id,
+                        eve_type_id=eve_type_id,
+                        eve_solar_system=eve_solar_system,
+                        quantity=quantity,
+                        updated_at=updated_at,
+                    )
+                )
+            elif (
+                entry.quantity != quantity
+                or entry.eve_solar_system_id != eve_solar_system.id
+            ):
+                entry.quantity = quantity
+                entry.eve_solar_system = eve_solar_system
+                entry.updated_at = updated_at
+                toupdate.append(entry)
+        self.bulk_create(tocreate, batch_size=500)
+        self.bulk_update(
+            toupdate, ["quantity", "eve_solar_system", "updated_at"], batch_size=500
+        )
+        logger.debug(
+            "%s: Created %d and updated %d mining log entries",
+            observer,
+            len(tocreate),
+            len(toupdate),
+        )
+        return tocreate + toupdate
+
+    def add_to_mining_ledgers(self, characters: models.QuerySet = None) -> list:
+        """Add the moon mining of registered characters to their mining ledgers.
+
+        Only days with log entries stored or changed since the last run
+        for a character are considered. Quantities of all observers are summed up
+        per date, solar system and type.
+
+        Args:
+        - characters: Characters to update, defaults to all characters
+
+        Returns:
+        - Created and updated mining ledger entries
+        """
+        if characters is None:
+            characters = Character.objects.all()
+        character = characters.filter(eve_character__character_id=OuterRef("miner_id"))
+        changed_days = (
+            self.annotate(
+                character_pk=Subquery(character.values("pk")[:1]),
+                last_updated=Subquery(character.values("moon_log_updated_at")[:1]),
+            )
+            .filter(character_pk__isnull=False)
+            .filter(Q(last_updated__isnull=True) | Q(updated_at__gt=F("last_updated")))
+            .values("character_pk", "miner_id", "date")
+            .annotate(latest=Max("updated_at"))
+            .order_by()
+        )
+        miner_characters = {}
+        days = set()
+        last_updated = {}
+        for row in changed_days:
+            miner_characters[row["miner_id"]] = row["character_pk"]
+            days.add((row["miner_id"], row["date"]))
+            last_updated[row["character_pk"]] = max(
+                row["latest"], last_updated.get(row["character_pk"], row["latest"])
+            )
+        quantities = {}
+        if days:
+            for row in (
+                self.filter(
+                    miner_id__in=miner_characters.keys(),
+                    date__in={date for _, date in days},
+                )
+                .values("miner_id", "date", "eve_solar_system_id", "eve_type_id")
+                .annotate(quantity_total=Sum("quantity"))
+                .order_by()
+            ):
+                if (row["miner_id"], row["date"]) not in days:
+                    continue
+                key = (
+                    miner_characters[row["miner_id"]],
+                    row["date"],
+                    row["eve_solar_system_id"],
+                    row["eve_type_id"],
+                )
+                quantities[key] = row["quantity_total"]
+        entries = CharacterMiningLedgerEntry.objects.bulk_upsert_many(quantities)
+        Character.objects.bulk_update(
+            [
+                Character(
+                    pk=pk, moon_log_updated_at=latest - MOON_LOG_WATERMARK_OVERLAP
+                )
+                for pk, latest in last_updated.items()
+            ],
+            ["moon_log_updated_at"],
+            batch_size=500,
+        )
+        logger.info(
+            "Added moon mining of %d characters to their mining ledgers",
+            len(last_updated),
+        )
+        return entries
+
+
 class AdminMiningObsLog(models.Model):
     """Mining Log for a given Observer."""
 
@@ -161,6 +552,11 @@ class AdminMiningObsLog(models.Model):
     eve_solar_system = models.ForeignKey(
         EveSolarSystem, on_delete=models.CASCADE, related_name="+"
     )
+    updated_at = models.DateTimeField(
+        default=now, db_index=True, help_text="When this entry was last stored"
+    )
+
+    objects = AdminMiningObsLogManager()
 
     class Meta:
         default_permissions = ()
@@ -175,6 +571,68 @@ class AdminMiningObsLog(models.Model):
         return f"{self.observer} miningObs {self.id}"
 
 
+class AdminMiningCorpLedgerEntryQuerySet(models.QuerySet):
+    def with_payees(self) -> models.QuerySet:
+        """Annotate the PK of the character to be credited for an entry as payee_id.
+
+        The payee is the registered character itself, else the first registered
+        character of the user owning it if that user has a main character.
+        """
+        own_character = Character.objects.filter(
+            eve_character__character_id=OuterRef("taxed_id")
+        ).values("pk")[:1]
+        owner = "eve_character__character_ownership__user"
+        user_character = (
+            Character.objects.filter(
+                **{
+                    f"{owner}__character_ownerships__character__character_id": (
+                        OuterRef("taxed_id")
+                    ),
+                    f"{owner}__profile__main_character__isnull": False,
+                }
+            )
+            .order_by("pk")
+            .values("pk")[:1]
+        )
+        return self.annotate(
+            payee_id=Coalesce(Subquery(own_character), Subquery(user_character))
+        )
+
+    def add_tax_credits(self, phrase: str = "") -> list:
+        """Credit the payees of all entries matching the phrase
+        that have not yet been credited.
+
+        Returns:
+        - list of created tax credits
+        """
+        entries = self
+        phrase = phrase.strip()
+        if phrase:
+            entries = entries.filter(reason__icontains=phrase)
+        already_credited = CharacterTaxCredits.objects.filter(
+            character_id=OuterRef("payee_id"),
+            date=OuterRef("date"),
+            credit=OuterRef("amount"),
+        )
+        new_credits = {}
+        for payee_id, date, amount in (
+            entries.with_payees()
+            .filter(payee_id__isnull=False)
+            .exclude(Exists(already_credited))
+            .values_list("payee_id", "date", "amount")
+        ):
+            new_credits[(payee_id, date, amount)] = CharacterTaxCredits(
+                character_id=payee_id, date=date, credit=amount, credit_type="paid"
+            )
+        new_credits = list(new_credits.values())
+        if new_credits:
+            CharacterTaxCredits.objects.bulk_create(
+                new_credits, batch_size=500, ignore_conflicts=True
+            )
+            credits_changed(new_credits)
+        return new_credits
+
+
 class AdminMiningCorpLedgerEntry(models.Model):
     """Corp ledger entry of a character."""
 
@@ -186,6 +644,8 @@ class AdminMiningCorpLedgerEntry(models.Model):
     amount = models.FloatField(default=0.0)
     reason = models.CharField(max_length=32)
 
+    objects = models.Manager.from_queryset(AdminMiningCorpLedgerEntryQuerySet)()
+
     class Meta:
         default_permissions = ()
         constraints = [
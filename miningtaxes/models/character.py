@@ -2,14 +2,17 @@
 import datetime as dt
 import hashlib
 import json
-from typing import Any, Optional
+from collections import namedtuple
+from typing import Any, Iterable, Optional
+from uuid import uuid4
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models import Sum
-from django.db.models.functions import TruncMonth
+from django.db.models import Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils.functional import cached_property
 from django.utils.timezone import now
 from esi.errors import TokenError
@@ -25,18 +28,104 @@ from app_utils.logging import LoggerAddTag
 
 from .. import __title__
 from ..app_settings import (
+    MININGTAXES_BALANCE_CACHE_TIMEOUT,
     MININGTAXES_TAX_ONLY_CORP_MOONS,
     MININGTAXES_UPDATE_LEDGER_STALE,
     MININGTAXES_UPDATE_STALE_OFFSET,
 )
 from ..decorators import fetch_token_for_character
-from ..helpers import PriceGroups
-from ..providers import esi
-from .orePrices import get_tax, ore_calc_prices
+from ..helpers import PriceGroups, bulk_get_or_create_esi, to_date
+from ..providers import esi, esi_results_if_modified, store_etag
+from .orePrices import PriceTable, get_tax, ore_calc_prices
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
 
+def _balance_version_key(character_pk: int) -> str:
+    return f"miningtaxes-balance-version-{character_pk}"
+
+
+def bump_balance_versions(character_pks: Iterable[int]) -> None:
+    """Invalidate the cached balances of the users owning these characters."""
+    cache.set_many(
+        {_balance_version_key(pk): uuid4().hex for pk in set(character_pks)},
+        timeout=None,
+    )
+
+
+_LEDGER_VERSION_KEY = "miningtaxes-ledger-version"
+
+
+def ledger_version() -> str:
+    """Version of the mining ledgers of all characters, which changes
+    whenever entries are stored or deleted.
+    """
+    return cache.get_or_set(_LEDGER_VERSION_KEY, lambda: uuid4().hex, timeout=None)
+
+
+def bump_ledger_version() -> None:
+    cache.set(_LEDGER_VERSION_KEY, uuid4().hex, timeout=None)
+
+
+def ledger_changed(entries) -> None:
+    """Update balances and summaries after mining ledger entries have changed."""
+    from .summaries import update_summaries
+
+    entries = list(entries)
+    character_pks = {entry.character_id for entry in entries}
+    bump_balance_versions(character_pks)
+    bump_ledger_version()
+    if character_pks:
+        Character.objects.filter(pk__in=character_pks).update_lifetime_taxes()
+    update_summaries(ledger_entries=entries)
+
+
+def credits_changed(credits) -> None:
+    """Update balances and summaries after tax credits have changed."""
+    from .summaries import update_summaries
+
+    credits = list(credits)
+    character_pks = {credit.character_id for credit in credits}
+    bump_balance_versions(character_pks)
+    if character_pks:
+        Character.objects.filter(pk__in=character_pks).update_lifetime_credits()
+    update_summaries(credits=credits)
+
+
+ResolvedCharacter = namedtuple(
+    "ResolvedCharacter", ["name", "main", "category", "character"]
+)
+"""An EVE character ID resolved to its owner.
+
+- name: Name of the main character if the character is registered,
+  else the name of the character or a link to it on evewho
+- main: Main character of the owning user or None
+- category: "found", "unregistered" or "unknown"
+- character: Character to be credited for the ID, which is the character
+  itself or else a registered character of the owning user, or None
+"""
+
+
+def _lifetime_taxes():
+    taxes = (
+        CharacterMiningLedgerEntry.objects.filter(character=OuterRef("pk"))
+        .values("character")
+        .annotate(total=Sum("taxes_owed"))
+        .values("total")
+    )
+    return Coalesce(Subquery(taxes, output_field=models.FloatField()), Value(0.0))
+
+
+def _lifetime_credits():
+    credits = (
+        CharacterTaxCredits.objects.filter(character=OuterRef("pk"))
+        .values("character")
+        .annotate(total=Sum("credit"))
+        .values("total")
+    )
+    return Coalesce(Subquery(credits, output_field=models.FloatField()), Value(0.0))
+
+
 class CharacterQuerySet(models.QuerySet):
     def eve_character_ids(self) -> set:
         return set(self.values_list("eve_character__character_id", flat=True))
@@ -45,6 +134,74 @@ class CharacterQuerySet(models.QuerySet):
         """Filter character owned by user."""
         return self.filter(eve_character__character_ownership__user__pk=user.pk)
 
+    def with_owner_graph(self) -> models.QuerySet:
+        """Load the owner chain of characters with the same query,
+        so that user, main_character and is_main need no further queries.
+        """
+        return self.select_related(
+            "eve_character__character_ownership__user__profile__main_character"
+        )
+
+    def with_balances(self, before: dt.date = None) -> models.QuerySet:
+        """Annotate the taxes owed before the given date as taxes_due
+        and all credits as credits_total.
+
+        Args:
+        - before: Defaults to the first day of the current month
+        """
+        if before is None:
+            before = now().date().replace(day=1)
+        taxes = (
+            CharacterMiningLedgerEntry.objects.filter(
+                character=OuterRef("pk"), date__lt=before
+            )
+            .values("character")
+            .annotate(total=Sum("taxes_owed"))
+            .values("total")
+        )
+        credits = (
+            CharacterTaxCredits.objects.filter(character=OuterRef("pk"))
+            .values("character")
+            .annotate(total=Sum("credit"))
+            .values("total")
+        )
+        return self.annotate(
+            taxes_due=Coalesce(
+                Subquery(taxes, output_field=models.FloatField()), Value(0.0)
+            ),
+            credits_total=Coalesce(
+                Subquery(credits, output_field=models.FloatField()), Value(0.0)
+            ),
+        )
+
+    def with_lifetime_totals(self) -> models.QuerySet:
+        """Annotate the sum of all taxes owed as life_taxes_total
+        and of all credits as life_credits_total.
+        """
+        return self.annotate(
+            life_taxes_total=_lifetime_taxes(), life_credits_total=_lifetime_credits()
+        )
+
+    def with_last_paid(self) -> models.QuerySet:
+        """Annotate the date of the latest tax credit as last_paid_date."""
+        last_paid = (
+            CharacterTaxCredits.objects.filter(character=OuterRef("pk"))
+            .values("character")
+            .annotate(last=Max("date"))
+            .values("last")
+        )
+        return self.annotate(last_paid_date=Subquery(last_paid))
+
+    def update_lifetime_taxes(self) -> int:
+        """Store the lifetime taxes of these characters with one query."""
+        return self.update(life_taxes=_lifetime_taxes(), life_taxes_updated_at=now())
+
+    def update_lifetime_credits(self) -> int:
+        """Store the lifetime credits of these characters with one query."""
+        return self.update(
+            life_credits=_lifetime_credits(), life_credits_updated_at=now()
+        )
+
 
 class CharacterManagerBase(ObjectCacheMixin, models.Manager):
     def unregistered_characters_of_user_count(self, user: User) -> int:
@@ -52,6 +209,165 @@ class CharacterManagerBase(ObjectCacheMixin, models.Manager):
             user=user, character__memberaudit_character__isnull=True
         ).count()
 
+    def resolve_character_ids(self, character_ids: Iterable[int]) -> dict:
+        """Resolve EVE character IDs to their owners with two queries.
+
+        Returns:
+        - dict of EVE character ID to ResolvedCharacter
+        """
+        character_ids = set(character_ids)
+        eve_characters = {
+            eve_character.character_id: eve_character
+            for eve_character in EveCharacter.objects.filter(
+                character_id__in=character_ids
+            ).select_related(
+                "miningtaxes_character",
+                "character_ownership__user__profile__main_character",
+            )
+        }
+
+        def owner_of(eve_character):
+            try:
+                return eve_character.character_ownership.user
+            except ObjectDoesNotExist:
+                return None
+
+        user_ids = {
+            owner_of(eve_character).pk
+            for eve_character in eve_characters.values()
+            if owner_of(eve_character) is not None
+        }
+        user_characters = {}
+        if user_ids:
+            for character in (
+                self.filter(eve_character__character_ownership__user_id__in=user_ids)
+                .select_related("eve_character__character_ownership")
+                .order_by("pk")
+            ):
+                user_characters.setdefault(
+                    character.eve_character.character_ownership.user_id, character
+                )
+
+        result = {}
+        for character_id in character_ids:
+            eve_character = eve_characters.get(character_id)
+            if eve_character is None:
+                result[character_id] = ResolvedCharacter(
+                    name=(
+                        f"<a href='https://evewho.com/character/{character_id}'>"
+                        f"{character_id}</a>"
+                    ),
+                    main=None,
+                    category="unknown",
+                    character=None,
+                )
+                continue
+            user = owner_of(eve_character)
+            try:
+                main = user.profile.main_character if user is not None else None
+            except ObjectDoesNotExist:
+                main = None
+            try:
+                character = eve_character.miningtaxes_character
+            except ObjectDoesNotExist:
+                character = None
+            if character is not None and main is not None:
+                name = main.character_name
+                category = "found"
+            else:
+                name = eve_character.character_name
+                category = "unregistered"
+            if character is None and main is not None:
+                character = user_characters.get(user.pk)
+            result[character_id] = ResolvedCharacter(
+                name=name, main=main, category=category, character=character
+            )
+        return result
+
+    def user_balances(self, characters: models.QuerySet = None) -> dict:
+        """Calculate the taxes due of users from their characters with one query.
+
+        Taxes of the current month are not yet due.
+
+        Args:
+        - characters: Characters to include, defaults to all characters
+
+        Returns:
+        - dict of user to [taxes due, highest taxes of a character, that character]
+        """
+        if characters is None:
+            characters = self.all()
+        user2taxes = {}
+        for character in characters.with_balances().with_owner_graph().order_by("pk"):
+            user = character.user
+            if user is None:
+                continue
+            if user not in user2taxes:
+                user2taxes[user] = [0.0, 0.0, character]
+            user2taxes[user][0] += character.taxes_due
+            if character.taxes_due > user2taxes[user][1]:
+                user2taxes[user][1] = character.taxes_due
+                user2taxes[user][2] = character
+            user2taxes[user][0] -= round(character.credits_total, 2)
+
+        for user in user2taxes.keys():
+            taxes_due = round(user2taxes[user][0], 2)
+            if taxes_due == 0.00:
+                taxes_due = abs(taxes_due)
+            user2taxes[user][0] = taxes_due
+        return user2taxes
+
+    def user_balance(self, user: User) -> dict:
+        """Calculate the balance of one user from the user's characters only.
+
+        The result is cached until the ledger or credits of one of the
+        user's characters change.
+
+        Returns:
+        - dict with taxes_due, balance and last_paid
+        """
+        characters = self.owned_by_user(user)
+        character_pks = sorted(characters.values_list("pk", flat=True))
+        version_keys = [_balance_version_key(pk) for pk in character_pks]
+        versions = cache.get_many(version_keys)
+        missing = {key: uuid4().hex for key in version_keys if key not in versions}
+        if missing:
+            cache.set_many(missing, timeout=None)
+            versions.update(missing)
+        signature = hashlib.md5(
+            ",".join(
+                f"{pk}:{versions[key]}" for pk, key in zip(character_pks, version_keys)
+            ).encode("utf-8")
+        ).hexdigest()
+        month = now().date().replace(day=1)
+        cache_key = f"miningtaxes-user-balance-{user.pk}-{month}-{signature}"
+        result = cache.get(cache_key)
+        if result is not None:
+            return result
+
+        result = {"taxes_due": 0.0, "balance": 0.0, "last_paid": None}
+        for character in (
+            self.filter(pk__in=character_pks)
+            .with_balances(before=month)
+            .with_lifetime_totals()
+            .with_last_paid()
+            .values("taxes_due", "credits_total", "life_taxes_total", "last_paid_date")
+        ):
+            credits = round(character["credits_total"], 2)
+            result["taxes_due"] += character["taxes_due"] - credits
+            result["balance"] += round(character["life_taxes_total"], 2) - credits
+            last_paid = character["last_paid_date"]
+            if last_paid is not None and (
+                result["last_paid"] is None or last_paid > result["last_paid"]
+            ):
+                result["last_paid"] = last_paid
+        taxes_due = round(result["taxes_due"], 2)
+        if taxes_due == 0.00:
+            taxes_due = abs(taxes_due)
+        result["taxes_due"] = taxes_due
+        cache.set(cache_key, result, MININGTAXES_BALANCE_CACHE_TIMEOUT)
+        return result
+
 
 CharacterManager = CharacterManagerBase.from_queryset(CharacterQuerySet)
 
@@ -205,39 +521,61 @@ class CharacterAbstract(models.Model):
 
 class Character(CharacterAbstract):
     life_credits = models.FloatField(default=0.0)
+    life_credits_updated_at = models.DateTimeField(
+        null=True, default=None, help_text="When life_credits was last calculated"
+    )
     life_taxes = models.FloatField(default=0.0)
-    monthly_mining_json = models.JSONField(default=None, null=True)
-    monthly_taxes_json = models.JSONField(default=None, null=True)
-    monthly_credits_json = models.JSONField(default=None, null=True)
+    life_taxes_updated_at = models.DateTimeField(
+        null=True, default=None, help_text="When life_taxes was last calculated"
+    )
+    moon_log_updated_at = models.DateTimeField(
+        null=True,
+        default=None,
+        help_text=(
+            "Moon observer log entries stored after this time "
+            "are not yet added to the mining ledger"
+        ),
+    )
 
     @fetch_token_for_character("esi-industry.read_character_mining.v1")
     def update_mining_ledger(self, token: Token):
         """Update mining ledger from ESI for this character."""
         logger.info("%s: Fetching mining ledger from ESI", self)
-        entries = esi.client.Industry.get_characters_character_id_mining(
-            character_id=self.eve_character.character_id,
+        character_id = self.eve_character.character_id
+        etag_key = f"miningtaxes-etag-mining-ledger-{character_id}"
+        entries, etag = esi_results_if_modified(
+            esi.client.Industry.get_characters_character_id_mining,
+            etag_key=etag_key,
+            character_id=character_id,
             token=token.valid_access_token(),
-        ).results()
+        )
+        if entries is None:
+            logger.info("%s: Mining ledger has not changed", self)
+            return
+        update_status, _ = self.update_status_set.get_or_create()
+        if not update_status.has_changed(entries):
+            logger.info("%s: Mining ledger has not changed", self)
+            store_etag(etag_key, etag)
+            return
+        eve_types = bulk_get_or_create_esi(
+            EveType, {entry["type_id"] for entry in entries}
+        )
+        bulk_get_or_create_esi(
+            EveSolarSystem, {entry["solar_system_id"] for entry in entries}
+        )
+        quantities = {}
         for entry in entries:
-            eve_type, _ = EveType.objects.get_or_create_esi(id=entry["type_id"])
+            eve_type = eve_types[entry["type_id"]]
             if (
                 eve_type.eve_group_id in PriceGroups.moon_ore_groups
             ) and MININGTAXES_TAX_ONLY_CORP_MOONS:
                 continue
-
-            eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
-                id=entry["solar_system_id"]
-            )
-            (row, _) = self.mining_ledger.update_or_create(
-                date=entry["date"],
-                eve_solar_system=eve_solar_system,
-                eve_type=eve_type,
-                defaults={"quantity": entry["quantity"]},
-            )
-            row.calc_prices()
-        self.calc_lifetime_taxes()
-        self.calc_monthly_taxes()
-        self.calc_monthly_mining()
+            key = (to_date(entry["date"]), entry["solar_system_id"], eve_type.id)
+            quantities[key] = entry["quantity"]
+        CharacterMiningLedgerEntry.objects.bulk_upsert(self, quantities)
+        self.refresh_from_db(fields=["life_taxes", "life_taxes_updated_at"])
+        update_status.update_content_hash(entries)
+        store_etag(etag_key, etag)
 
     @classmethod
     def get_esi_scopes(cls) -> list:
@@ -245,23 +583,6 @@ class Character(CharacterAbstract):
             "esi-industry.read_character_mining.v1",
         ]
 
-    def json_standardize(self, months):
-        newmonths = {}
-        for h in months:
-            if type(h["month"]) == dt.datetime:
-                h["month"] = str(h["month"].date())
-            else:
-                h["month"] = str(h["month"])
-            newmonths[h["month"]] = h["total"]
-        return newmonths
-
-    def standardize(self, months):
-        newmonths = {}
-        for k in months.keys():
-            kn = dt.datetime.strptime(k, "%Y-%m-%d").date()
-            newmonths[kn] = months[k]
-        return newmonths
-
     def calc_lifetime_taxes(self):
         amount = self.mining_ledger.all().aggregate(Sum("taxes_owed"))[
             "taxes_owed__sum"
@@ -269,75 +590,44 @@ class Character(CharacterAbstract):
         if amount is None:
             amount = 0.0
         self.life_taxes = amount
-        self.save()
+        self.life_taxes_updated_at = now()
+        self.save(update_fields=["life_taxes", "life_taxes_updated_at"])
 
     def calc_lifetime_credits(self):
         amount = self.tax_credits.all().aggregate(Sum("credit"))["credit__sum"]
         if amount is None:
             amount = 0.0
         self.life_credits = amount
-        self.save()
+        self.life_credits_updated_at = now()
+        self.save(update_fields=["life_credits", "life_credits_updated_at"])
 
     def get_lifetime_taxes(self):
-        if self.life_taxes == 0.0:
+        if self.life_taxes_updated_at is None:
             self.calc_lifetime_taxes()
         return round(self.life_taxes, 2)
 
     def get_lifetime_credits(self):
-        if self.life_credits == 0.0:
+        if self.life_credits_updated_at is None:
             self.calc_lifetime_credits()
         return round(self.life_credits, 2)
 
-    def calc_monthly_taxes(self):
-        dat = (
-            self.mining_ledger.all()
-            .annotate(month=TruncMonth("date"))
-            .values("month")
-            .annotate(total=Sum("taxes_owed"))
-            .order_by("month")
-        )
-
-        self.monthly_taxes_json = self.json_standardize(dat)
-        self.save()
+    def _monthly_totals(self, field: str, summaries: models.QuerySet) -> dict:
+        return dict(summaries.order_by("month").values_list("month", field))
 
     def get_monthly_taxes(self):
-        if self.monthly_taxes_json is None:
-            self.calc_monthly_taxes()
-        return self.standardize(self.monthly_taxes_json)
-
-    def calc_monthly_credits(self):
-        dat = (
-            self.tax_credits.all()
-            .annotate(month=TruncMonth("date"))
-            .values("month")
-            .annotate(total=Sum("credit"))
-            .order_by("month")
+        return self._monthly_totals(
+            "taxes_owed", self.monthly_summaries.filter(quantity__gt=0)
         )
 
-        self.monthly_credits_json = self.json_standardize(dat)
-        self.save()
-
     def get_monthly_credits(self):
-        if self.monthly_credits_json is None:
-            self.calc_monthly_credits()
-        return self.standardize(self.monthly_credits_json)
-
-    def calc_monthly_mining(self):
-        dat = (
-            self.mining_ledger.all()
-            .annotate(month=TruncMonth("date"))
-            .values("month")
-            .annotate(total=Sum("taxed_value"))
-            .order_by("month")
+        return self._monthly_totals(
+            "credits", self.monthly_summaries.exclude(credits=0.0)
         )
 
-        self.monthly_mining_json = self.json_standardize(dat)
-        self.save()
-
     def get_monthly_mining(self):
-        if self.monthly_mining_json is None:
-            self.calc_monthly_mining()
-        return self.standardize(self.monthly_mining_json)
+        return self._monthly_totals(
+            "taxed_value", self.monthly_summaries.filter(quantity__gt=0)
+        )
 
     def get_90d_mining(self):
         b = now().date() - dt.timedelta(days=90)
@@ -353,15 +643,11 @@ class Character(CharacterAbstract):
         if credit_type not in ("credit", "paid", "interest"):
             raise Exception("Unknown credit type")
         self.tax_credits.create(date=now(), credit=isk, credit_type=credit_type)
-        self.calc_lifetime_credits()
-        self.calc_monthly_credits()
+        self.refresh_from_db(fields=["life_credits", "life_credits_updated_at"])
 
     def precalc_all(self):
         self.calc_lifetime_taxes()
         self.calc_lifetime_credits()
-        self.calc_monthly_taxes()
-        self.calc_monthly_credits()
-        self.calc_monthly_mining()
 
 
 class CharacterTaxCredits(models.Model):
@@ -384,6 +670,10 @@ class CharacterTaxCredits(models.Model):
     def __str__(self) -> str:
         return f"{self.character} - {self.date} - {self.credit} ISK"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        credits_changed([self])
+
 
 class CharacterUpdateStatus(models.Model):
     """Update status for a character"""
@@ -480,9 +770,126 @@ class CharacterMiningLedgerEntryQueryset(models.QuerySet):
         """Annotate price and total columns."""
         return
 
+    def activity(self) -> models.QuerySet:
+        """Entries of characters with a main and of taxable types as dicts
+        with the names of their solar system, character, main and type.
+        """
+        main_name = (
+            "character__eve_character__character_ownership__user__profile"
+            "__main_character__character_name"
+        )
+        return self.filter(
+            eve_type__eve_group_id__in=PriceGroups.taxgroups.keys(),
+            **{f"{main_name}__isnull": False},
+        ).values(
+            "id",
+            "date",
+            "eve_type_id",
+            "quantity",
+            "taxed_value",
+            "taxes_owed",
+            system_name=models.F("eve_solar_system__name"),
+            character_name=models.F("character__eve_character__character_name"),
+            main_name=models.F(main_name),
+            type_name=models.F("eve_type__name"),
+        )
+
 
 class CharacterMiningLedgerEntryManagerBase(models.Manager):
-    pass
+    def bulk_upsert(self, character, quantities: dict) -> list:
+        """Create or update many entries of a character at once.
+
+        New and changed entries are priced before they are stored.
+
+        Args:
+        - character: Character the entries belong to
+        - quantities: Quantities keyed by (date, solar system ID, type ID)
+
+        Returns:
+        - Created and updated entries
+        """
+        return self.bulk_upsert_many(
+            {(character.pk,) + key: quantity for key, quantity in quantities.items()}
+        )
+
+    def bulk_upsert_many(self, quantities: dict) -> list:
+        """Create or update many entries of many characters at once.
+
+        New and changed entries are priced together before they are stored,
+        as are unchanged entries that have no price yet.
+
+        Args:
+        - quantities: Quantities keyed by
+          (character PK, date, solar system ID, type ID)
+
+        Returns:
+        - Created and updated entries
+        """
+        if not quantities:
+            return []
+        existing = {
+            (
+                entry.character_id,
+                entry.date,
+                entry.eve_solar_system_id,
+                entry.eve_type_id,
+            ): entry
+            for entry in self.filter(
+                character_id__in={key[0] for key in quantities.keys()},
+                date__in={key[1] for key in quantities.keys()},
+            )
+        }
+        tocreate = []
+        toupdate = []
+        unpriced = []
+        for key, quantity in quantities.items():
+            entry = existing.get(key)
+            if entry is None:
+                character_pk, date, eve_solar_system_id, eve_type_id = key
+                tocreate.append(
+                    self.model(
+                        character_id=character_pk,
+                        date=date,
+                        eve_solar_system_id=eve_solar_system_id,
+                        eve_type_id=eve_type_id,
+                        quantity=quantity,
+                    )
+                )
+            elif entry.quantity != quantity:
+                entry.quantity = quantity
+                toupdate.append(entry)
+            elif entry.raw_price == 0.0:
+                unpriced.append(entry)
+        self._set_prices(tocreate + toupdate + unpriced)
+        toupdate += [entry for entry in unpriced if entry.raw_price != 0.0]
+        self.bulk_create(tocreate, batch_size=500)
+        self.bulk_update(
+            toupdate,
+            ["quantity", "raw_price", "refined_price", "taxed_value", "taxes_owed"],
+            batch_size=500,
+        )
+        ledger_changed(tocreate + toupdate)
+        logger.debug(
+            "Created %d and updated %d mining ledger entries",
+            len(tocreate),
+            len(toupdate),
+        )
+        return tocreate + toupdate
+
+    @staticmethod
+    def _set_prices(entries):
+        """Calculate the prices of many entries in one pass without storing them."""
+        if not entries:
+            return
+        price_table = PriceTable()
+        price_table.load_types({entry.eve_type_id for entry in entries})
+        for entry in entries:
+            (
+                entry.raw_price,
+                entry.refined_price,
+                entry.taxed_value,
+                entry.taxes_owed,
+            ) = price_table.calc_prices(entry.eve_type_id, entry.quantity)
 
 
 CharacterMiningLedgerEntryManager = CharacterMiningLedgerEntryManagerBase.from_queryset(
@@ -521,13 +928,22 @@ class CharacterMiningLedgerEntry(models.Model):
     def __str__(self) -> str:
         return f"{self.character} {self.id}"
 
-    def calc_prices(self):
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        ledger_changed([self])
+
+    def calc_prices(self, settings=None):
+        """Calculate and store the prices of this entry unless it has them.
+
+        Args:
+        - settings: Settings to use when pricing many entries one by one
+        """
         if self.raw_price != 0.0:
             return
         self.raw_price, self.refined_price, self.taxed_value = ore_calc_prices(
             self.eve_type, self.quantity
         )
-        self.taxes_owed = get_tax(self.eve_type) * self.taxed_value
+        self.taxes_owed = get_tax(self.eve_type, settings) * self.taxed_value
         self.raw_price = round(self.raw_price, 2)
         self.refined_price = round(self.refined_price, 2)
         self.taxed_value = round(self.taxed_value, 2)
@@ -1,7 +1,10 @@
 # Shamelessly stolen from Member Audit
+import hashlib
+from collections import defaultdict
+
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from eveuniverse.models import EveType, EveTypeMaterial
+from eveuniverse.models import EveMarketPrice, EveType, EveTypeMaterial
 
 from allianceauth.services.hooks import get_extension_logger
 from app_utils.logging import LoggerAddTag
@@ -18,18 +21,81 @@ from .settings import Settings
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
 
-def get_tax(eve_type):
-    settings = Settings.load()
-    pg = PriceGroups()
-    if eve_type.eve_group_id not in pg.taxgroups:
+def get_tax(eve_type, settings=None):
+    """Return the tax rate of a type.
+
+    Args:
+    - settings: Settings to use, so that callers pricing many entries
+      load them only once. Loaded when not provided.
+    """
+    if eve_type.eve_group_id not in PriceGroups.taxgroups:
         logger.debug(
             "Unknown evetype for %s, group: %d" % (eve_type, eve_type.eve_group_id)
         )
         return MININGTAXES_UNKNOWN_TAX_RATE
-    group = "tax_" + pg.taxgroups[eve_type.eve_group_id]
+    if settings is None:
+        settings = Settings.load()
+    group = "tax_" + PriceGroups.taxgroups[eve_type.eve_group_id]
     return settings.__dict__[group] / 100.0
 
 
+class PriceTable:
+    """In-memory price and tax rate table for pricing many entries at once.
+
+    Prices of all types are loaded from OrePrices in one query and tax rates
+    are resolved per type from the current settings.
+    """
+
+    def __init__(self):
+        settings = Settings.load()
+        self._group_tax_rates = {
+            group_id: getattr(settings, "tax_" + taxgroup) / 100.0
+            for group_id, taxgroup in PriceGroups.taxgroups.items()
+        }
+        self._unit_prices = {
+            eve_type_id: (raw_price, refined_price, taxed_price)
+            for eve_type_id, raw_price, refined_price, taxed_price in (
+                OrePrices.objects.values_list(
+                    "eve_type_id", "raw_price", "refined_price", "taxed_price"
+                )
+            )
+        }
+        self._tax_rates = {}
+
+    def load_types(self, type_ids):
+        """Resolve tax rates and missing prices of the given types."""
+        missing = set(type_ids) - self._tax_rates.keys()
+        if not missing:
+            return
+        for eve_type in EveType.objects.filter(id__in=missing):
+            try:
+                self._tax_rates[eve_type.id] = self._group_tax_rates[
+                    eve_type.eve_group_id
+                ]
+            except KeyError:
+                logger.debug(
+                    "Unknown evetype for %s, group: %d"
+                    % (eve_type, eve_type.eve_group_id)
+                )
+                self._tax_rates[eve_type.id] = MININGTAXES_UNKNOWN_TAX_RATE
+            if eve_type.id not in self._unit_prices:
+                self._unit_prices[eve_type.id] = ore_calc_prices(eve_type, 1)
+
+    def calc_prices(self, type_id, quantity):
+        """Return raw price, refined price, taxed value and taxes owed
+        for a quantity of the given type.
+        """
+        self.load_types((type_id,))
+        raw_price, refined_price, taxed_price = self._unit_prices[type_id]
+        taxed_value = quantity * taxed_price
+        return (
+            round(quantity * raw_price, 2),
+            round(quantity * refined_price, 2),
+            round(taxed_value, 2),
+            round(self._tax_rates[type_id] * taxed_value, 2),
+        )
+
+
 def ore_calc_prices(eve_type, q):
     try:
         ore = OrePrices.objects.get(eve_type=eve_type)
@@ -75,6 +141,66 @@ def get_price(eve_type):
     return ore.buy
 
 
+def calc_refined_prices(ores) -> None:
+    """Calculate raw, refined and taxed prices of many ore prices at once.
+
+    The materials of all ores and the prices of all materials are loaded
+    with one query each, so the number of queries does not depend on
+    the number of ores.
+    """
+    materials = defaultdict(list)
+    for eve_type_id, material_id, quantity in EveTypeMaterial.objects.filter(
+        eve_type_id__in={ore.eve_type_id for ore in ores}
+    ).values_list("eve_type_id", "material_eve_type_id", "quantity"):
+        materials[eve_type_id].append((material_id, quantity))
+
+    material_ids = {
+        material_id for rows in materials.values() for material_id, _ in rows
+    }
+    material_prices = dict(
+        OrePrices.objects.filter(eve_type_id__in=material_ids).values_list(
+            "eve_type_id", "buy"
+        )
+    )
+    material_prices.update(
+        {ore.eve_type_id: ore.buy for ore in ores if ore.eve_type_id in material_ids}
+    )
+    for eve_type_id, average_price, adjusted_price in EveMarketPrice.objects.filter(
+        eve_type_id__in=material_ids - material_prices.keys()
+    ).values_list("eve_type_id", "average_price", "adjusted_price"):
+        if average_price is not None:
+            material_prices[eve_type_id] = average_price
+        elif adjusted_price is not None:
+            material_prices[eve_type_id] = adjusted_price
+
+    for ore in ores:
+        ore.raw_price = ore.buy
+        ore.refined_price = 0.0
+        for material_id, quantity in materials[ore.eve_type_id]:
+            q = MININGTAXES_REFINED_RATE * quantity / ore.eve_type.portion_size
+            ore.refined_price += q * material_prices.get(material_id, 0.0)
+        if ore.refined_price == 0.0:
+            ore.refined_price = ore.raw_price
+        ore.taxed_price = ore.refined_price
+        if MININGTAXES_ALWAYS_TAX_REFINED and ore.raw_price > ore.taxed_price:
+            ore.taxed_price = ore.raw_price
+
+
+class OrePricesManager(models.Manager):
+    def calc_prices(self) -> int:
+        """Recalculate the prices of all ores in one pass.
+
+        Returns:
+        - Number of updated ore prices
+        """
+        ores = list(self.select_related("eve_type"))
+        calc_refined_prices(ores)
+        self.bulk_update(
+            ores, ["raw_price", "refined_price", "taxed_price"], batch_size=500
+        )
+        return len(ores)
+
+
 class OrePrices(models.Model):
     eve_type = models.OneToOneField(
         EveType,
@@ -88,18 +214,37 @@ class OrePrices(models.Model):
     taxed_price = models.FloatField(default=0.0)
     updated = models.DateTimeField()
 
+    objects = OrePricesManager()
+
     def calc_prices(self):
-        self.raw_price = self.buy
-        materials = EveTypeMaterial.objects.filter(
-            eve_type_id=self.eve_type.id
-        ).prefetch_related("eve_type")
-        self.refined_price = 0.0
-        for mat in materials:
-            q = MININGTAXES_REFINED_RATE * mat.quantity / self.eve_type.portion_size
-            self.refined_price += q * get_price(mat.material_eve_type)
-        if self.refined_price == 0.0:
-            self.refined_price = self.raw_price
-        self.taxed_price = self.refined_price
-        if MININGTAXES_ALWAYS_TAX_REFINED and self.raw_price > self.taxed_price:
-            self.taxed_price = self.raw_price
+        calc_refined_prices([self])
         self.save()
+
+
+class StaticDataFingerprint(models.Model):
+    """Fingerprint of the static data loaded from ESI for a priced type."""
+
+    eve_type = models.OneToOneField(
+        EveType,
+        on_delete=models.deletion.CASCADE,
+        primary_key=True,
+        related_name="+",
+    )
+    fingerprint = models.CharField(max_length=32)
+    loaded_at = models.DateTimeField()
+
+    class Meta:
+        default_permissions = ()
+
+    def __str__(self) -> str:
+        return f"{self.eve_type_id} {self.fingerprint}"
+
+    @staticmethod
+    def calc_fingerprint(eve_type_id: int) -> str:
+        """Calculate the fingerprint of the type materials of a type."""
+        materials = sorted(
+            EveTypeMaterial.objects.filter(eve_type_id=eve_type_id).values_list(
+                "material_eve_type_id", "quantity"
+            )
+        )
+        return hashlib.md5(str(materials).encode("utf-8")).hexdigest()
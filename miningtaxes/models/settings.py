@@ -1,4 +1,7 @@
 # Shamelessly stolen from Member Audit
+import hashlib
+
+from django.core.cache import cache
 from django.db import models
 
 from allianceauth.services.hooks import get_extension_logger
@@ -52,11 +55,33 @@ class Settings(models.Model):
     def save(self, *args, **kwargs):
         self.pk = 1
         super(Settings, self).save(*args, **kwargs)
+        self._update_cache()
 
     def delete(self, *args, **kwargs):
         pass
 
+    @classmethod
+    def _cache_key(cls) -> str:
+        """Cache key, which changes with the fields of this model."""
+        fields = ",".join(f.attname for f in cls._meta.concrete_fields)
+        version = hashlib.md5(fields.encode("utf-8")).hexdigest()
+        return f"miningtaxes-settings-{version}"
+
+    def _update_cache(self):
+        values = [getattr(self, f.attname) for f in self._meta.concrete_fields]
+        cache.set(self._cache_key(), values, timeout=None)
+
     @classmethod
     def load(cls):
+        """Return the settings, which are shared by all workers through the cache."""
+        values = cache.get(cls._cache_key())
+        if values is not None:
+            field_names = [f.attname for f in cls._meta.concrete_fields]
+            return cls.from_db("default", field_names, values)
         obj, _ = cls.objects.get_or_create(pk=1)
+        obj._update_cache()
         return obj
+
+    @classmethod
+    def clear_cache(cls):
+        cache.delete(cls._cache_key())
@@ -7,7 +7,6 @@ from django.db import models
 from django.urls import reverse
 from django.utils.timezone import now
 
-from allianceauth.eveonline.models import EveCharacter
 from allianceauth.services.hooks import get_extension_logger
 from app_utils.logging import LoggerAddTag
 from app_utils.views import bootstrap_icon_plus_name_html
@@ -18,11 +17,11 @@ from . import (
     AdminMiningCorpLedgerEntry,
     AdminMiningObsLog,
     Character,
-    CharacterMiningLedgerEntry,
     OrePrices,
     Settings,
     ore_calc_prices,
 )
+from .summaries import CharacterMonthlySummary, SystemMonthlySummary
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
@@ -37,7 +36,6 @@ class Stats(models.Model):
     admin_corp_ledger = models.JSONField(default=None, null=True)
     admin_corp_mining_history = models.JSONField(default=None, null=True)
     leaderboards = models.JSONField(default=None, null=True)
-    admin_get_all_activity_json = models.JSONField(default=None, null=True)
 
     def precalc_all(self):
         self.calc_admin_char_json()
@@ -49,74 +47,20 @@ class Stats(models.Model):
         self.calc_admin_corp_ledger()
         self.calc_admin_corp_mining_history()
         self.calc_leaderboards()
-        self.calc_admin_get_all_activity_json()
-
-    def characterize(self, char):
-        eve_char = None
-        category = None
-        name = None
-        try:
-            eve_char = EveCharacter.objects.get(character_id=char)
-        except EveCharacter.DoesNotExist:
-            name = f"<a href='https://evewho.com/character/{char}'>{char}</a>"
-            category = "unknown"
-            pass
-        if eve_char is not None:
-            try:
-                character = eve_char.miningtaxes_character
-                name = character.main_character.character_name
-                category = "found"
-            except AttributeError:
-                name = eve_char.character_name
-                category = "unregistered"
-                pass
-        return name, category
 
     def calctaxes(self):
-        n = now().date()
-        curmonth = dt.date(year=n.year, month=n.month, day=1)
-        user2taxes = {}
-        characters = Character.objects.all()
-        for character in characters:
-            if character.user is None:
-                continue
-            taxes = character.get_monthly_taxes()
-            total = 0.0
-            for k in taxes.keys():
-                if k != curmonth:
-                    total += taxes[k]
-            if character.user not in user2taxes:
-                user2taxes[character.user] = [0.0, 0.0, character]
-            user2taxes[character.user][0] += total
-            if total > user2taxes[character.user][1]:
-                user2taxes[character.user][1] = total
-                user2taxes[character.user][2] = character
-            credits = character.get_lifetime_credits()
-            user2taxes[character.user][0] -= credits
-
-        for user in user2taxes.keys():
-            taxes_due = round(user2taxes[user][0], 2)
-            if taxes_due == 0.00:
-                taxes_due = abs(taxes_due)
-            user2taxes[user][0] = taxes_due
-        return user2taxes
+        return Character.objects.user_balances()
 
     def calc_admin_char_json(self):
-        char_level = {}
-
-        for char in Character.objects.all():
-            char_level[char] = {
-                "life_tax": char.get_lifetime_taxes(),
-                "life_credits": char.get_lifetime_credits(),
-            }
-            char_level[char]["bal"] = (
-                char_level[char]["life_tax"] - char_level[char]["life_credits"]
-            )
-
+        characters = (
+            Character.objects.with_lifetime_totals().with_owner_graph().order_by("pk")
+        )
         char_data = []
-        for c in char_level.keys():
+        for c in characters:
             if c.eve_character is None or c.main_character is None:
                 continue
+            life_tax = round(c.life_taxes_total, 2)
+            life_credits = round(c.life_credits_total, 2)
             char_data.append(
                 {
                     "name": bootstrap_icon_plus_name_html(
@@ -134,13 +78,13 @@ class Stats(models.Model):
                         name=c.main_character.character_name,
                         size=16,
                     ),
-                    "taxes": char_level[c]["life_tax"],
-                    "credits": char_level[c]["life_credits"],
-                    "balance": char_level[c]["bal"],
+                    "taxes": life_tax,
+                    "credits": life_credits,
+                    "balance": life_tax - life_credits,
                 }
             )
-            self.admin_char_json = char_data
-            self.save()
+        self.admin_char_json = char_data
+        self.save()
 
     def get_admin_char_json(self):
         if self.admin_char_json is None:
@@ -164,13 +108,14 @@ class Stats(models.Model):
                     "life_credits": 0.0,
                     "last_paid": None,
                 }
-            main_level[m]["life_tax"] += char.get_lifetime_taxes()
-            main_level[m]["life_credits"] += char.get_lifetime_credits()
-            if char.last_paid() is not None and (
+            main_level[m]["life_tax"] += round(char.life_taxes_total, 2)
+            main_level[m]["life_credits"] += round(char.life_credits_total, 2)
+            last_paid = char.last_paid_date
+            if last_paid is not None and (
                 main_level[m]["last_paid"] is None
-                or char.last_paid() > main_level[m]["last_paid"]
+                or last_paid > main_level[m]["last_paid"]
             ):
-                main_level[m]["last_paid"] = char.last_paid()
+                main_level[m]["last_paid"] = last_paid
         for m in main_level.keys():
             main_level[m]["balance"] = (
                 main_level[m]["life_tax"] - main_level[m]["life_credits"]
@@ -179,7 +124,7 @@ class Stats(models.Model):
 
     def calc_admin_main_json(self):
         main_level, char2user, user2taxes = self.main_data_helper(
-            Character.objects.all()
+            Character.objects.with_lifetime_totals().with_last_paid().with_owner_graph()
         )
         main_data = []
         for i, m in enumerate(main_level.keys()):
@@ -222,7 +167,7 @@ class Stats(models.Model):
     def calc_ore_prices_json(self):
         settings = Settings.load()
         data = []
-        pg = PriceGroups()
+        pg = PriceGroups.load()
         for ore in OrePrices.objects.all():
             if "Compressed" in ore.eve_type.name:
                 continue
@@ -258,80 +203,22 @@ class Stats(models.Model):
             self.calc_ore_prices_json()
         return self.ore_prices_json
 
-    def calc_admin_get_all_activity_json(self):
-        entries = CharacterMiningLedgerEntry.objects.all().prefetch_related(
-            "character", "eve_type", "eve_solar_system"
-        )
-        sys = {}
-        pg = PriceGroups()
-        csv_data = [
-            [
-                "Date",
-                "Sys",
-                "Character",
-                "Main",
-                "Ore",
-                "Group",
-                "Amount",
-                "ISK Value",
-                "Taxed",
-            ]
-        ]
-        for e in entries:
-            try:
-                s = e.eve_solar_system.name
-                if s not in sys:
-                    sys[s] = {}
-
-                group = pg.taxgroups[e.eve_type.eve_group_id]
-
-                csv_data.append(
-                    [
-                        str(e.date),
-                        s,
-                        e.character.eve_character.character_name,
-                        e.character.main_character.character_name,
-                        e.eve_type.name,
-                        group,
-                        e.quantity,
-                        e.taxed_value,
-                        e.taxes_owed,
-                    ]
-                )
-            except Exception as e:
-                logger.error(f"Failed: {e}")
-                continue
-
-        self.admin_get_all_activity_json = csv_data
-        self.save()
-
-    def get_admin_get_all_activity_json(self):
-        if self.admin_get_all_activity_json is None:
-            self.calc_admin_get_all_activity_json()
-        return self.admin_get_all_activity_json
-
     def calc_admin_mining_by_sys_json(self):
-        entries = CharacterMiningLedgerEntry.objects.all().prefetch_related(
-            "character", "eve_type", "eve_solar_system"
-        )
+        summaries = SystemMonthlySummary.objects.select_related(
+            "eve_solar_system"
+        ).order_by("month")
         sys = {}
-        pg = PriceGroups()
         allgroups = set()
         tables = {}
 
-        for e in entries:
-            try:
-                s = e.eve_solar_system.name
-                if s not in sys:
-                    sys[s] = {}
-
-                group = pg.taxgroups[e.eve_type.eve_group_id]
-                allgroups.add(group)
-            except Exception as e:
-                logger.error(f"Failed: {e}")
-                continue
+        for e in summaries:
+            s = e.eve_solar_system.name
+            group = e.tax_group
+            allgroups.add(group)
+            if s not in sys:
+                sys[s] = {}
 
-            month = "%d-%02d" % (e.date.year, e.date.month)
+            month = "%d-%02d" % (e.month.year, e.month.month)
             if month not in tables:
                 tables[month] = {}
             if s not in tables[month]:
@@ -344,17 +231,14 @@ class Stats(models.Model):
 
             if group not in sys[s]:
                 sys[s][group] = {
-                    "first": e.date,
-                    "last": e.date,
+                    "first": e.first_date,
                     "q": e.quantity,
                     "isk": e.taxed_value,
                     "tax": e.taxes_owed,
                 }
                 continue
-            if e.date < sys[s][group]["first"]:
-                sys[s][group]["first"] = e.date
-            if e.date > sys[s][group]["last"]:
-                sys[s][group]["last"] = e.date
+            if e.first_date < sys[s][group]["first"]:
+                sys[s][group]["first"] = e.first_date
             sys[s][group]["isk"] += e.taxed_value
             sys[s][group]["tax"] += e.taxes_owed
             sys[s][group]["q"] += e.quantity
@@ -365,7 +249,6 @@ class Stats(models.Model):
                 if g not in sys[s]:
                     sys[s][g] = {"isk": 0, "tax": 0, "q": 0}
                     continue
-                # t = (sys[s][g]["last"] - sys[s][g]["first"]).days
                 t = (now().date() - sys[s][g]["first"]).days
                 t /= 365.25 / 12
                 if t < 1:
@@ -436,54 +319,20 @@ class Stats(models.Model):
         return self.admin_tax_revenue_json
 
     def calc_admin_month_json(self):
-        characters = Character.objects.all()
-        newchars = []
-        for c in characters:
-            if c.main_character is None:
-                logger.error(f"Missing main for {c}")
-                continue
-            newchars.append(c)
-        characters = newchars
-        monthly = list(map(lambda x: x.get_monthly_taxes(), characters))
-        users = list(map(lambda x: x.main_character.character_name, characters))
-        firstmonth = None
-        for entries in monthly:
-            if len(entries.keys()) == 0:
-                continue
-            if firstmonth is None or firstmonth > sorted(entries.keys())[0]:
-                firstmonth = sorted(entries.keys())[0]
-        xs = None
-        ys = {}
-        for i, entries in enumerate(monthly):
-            if not users[i] in ys:
-                ys[users[i]] = []
-            x = ["x"]
-            y = []
-            curmonth = firstmonth
+        monthly = {}
+        for row in CharacterMonthlySummary.objects.monthly_by_main():
+            monthly[row["month"]] = (
+                monthly.get(row["month"], 0.0) + row["taxes_owed_total"]
+            )
+        xs = ["x"]
+        yall = ["all"]
+        if monthly:
+            curmonth = min(monthly.keys())
             lastmonth = dt.date(now().year, now().month, 1)
             while curmonth <= lastmonth:
-                if curmonth not in entries:
-                    entries[curmonth] = 0.0
-                x.append(curmonth)
+                xs.append(curmonth)
+                yall.append(monthly.get(curmonth, 0.0))
                 curmonth += relativedelta(months=1)
-
-            if xs is None:
-                xs = x
-
-            for yi in range(1, len(xs)):
-                y.append(entries[xs[yi]])
-            ys[users[i]].append(y)
-        yout = []
-        for user in sorted(ys.keys()):
-            yout.append([user] + [sum(x) for x in zip(*ys[user])])
-
-        yall = ["all"]
-        for yi in range(1, len(xs)):
-            sumy = 0
-            for row in yout:
-                sumy += row[yi]
-            yall.append(sumy)
-        yout.insert(0, yall)
         yout = [yall]  # disable per main retrieval
 
         csvdata = [["Month", "Main", "Taxes Total"]]
@@ -503,34 +352,14 @@ class Stats(models.Model):
         return self.admin_month_json
 
     def calc_admin_corp_ledger(self):
-        obs = AdminMiningCorpLedgerEntry.objects.all().order_by("-date")
+        obs = list(AdminMiningCorpLedgerEntry.objects.all().order_by("-date"))
+        resolved = Character.objects.resolve_character_ids(o.taxed_id for o in obs)
         data = []
         for o in obs:
-            char = o.taxed_id
-            name = None
-            eve_char = None
-            try:
-                eve_char = EveCharacter.objects.get(character_id=char)
-            except EveCharacter.DoesNotExist:
-                name = f"<a href='https://evewho.com/character/{char}'>{char}</a>"
-                pass
-            except Exception as e:
-                logger.error(f"Error unknown user: {char}, error: {e}")
-                continue
-            if eve_char is not None:
-                try:
-                    character = eve_char.miningtaxes_character
-                    name = character.main_character.character_name
-                except AttributeError:
-                    name = eve_char.character_name
-                    pass
-                except Exception as e:
-                    logger.error(f"Error unknown user: {eve_char}, error: {e}")
-                    continue
             data.append(
                 {
                     "date": str(o.date),
-                    "name": name,
+                    "name": resolved[o.taxed_id].name,
                     "amount": o.amount,
                     "reason": o.reason,
                 }
@@ -545,16 +374,18 @@ class Stats(models.Model):
 
     def calc_admin_corp_mining_history(self):
         days_90 = now() - dt.timedelta(days=90)
-        obs = AdminMiningObsLog.objects.filter(date__gte=days_90).order_by("-date")
-        cache = {}
+        obs = list(
+            AdminMiningObsLog.objects.filter(date__gte=days_90)
+            .select_related("eve_type", "eve_solar_system")
+            .order_by("-date")
+        )
+        resolved = Character.objects.resolve_character_ids(o.miner_id for o in obs)
         data = []
         unknown_chars = {}
         unregistered_chars = {}
         for o in obs:
-            char = o.miner_id
-            if char not in cache:
-                cache[char] = self.characterize(char)
-            (name, category) = cache[char]
+            name = resolved[o.miner_id].name
+            category = resolved[o.miner_id].category
 
             if category == "unknown":
                 if name not in unknown_chars:
@@ -631,20 +462,12 @@ class Stats(models.Model):
         return self.admin_corp_mining_history
 
     def calc_leaderboards(self):
-        characters = Character.objects.all()
-        allentries = list(map(lambda x: x.get_monthly_mining(), characters))
         combined = {}
-        for i, entries in enumerate(allentries):
-            c = characters[i].main_character
-            if c is None:
-                logger.error(f"Missing main for {c}")
-                continue
-            for m in entries.keys():
-                if m not in combined:
-                    combined[m] = {}
-                if c.character_name not in combined[m]:
-                    combined[m][c.character_name] = 0.0
-                combined[m][c.character_name] += entries[m]
+        for row in CharacterMonthlySummary.objects.monthly_by_main():
+            m = row["month"]
+            if m not in combined:
+                combined[m] = {}
+            combined[m][row["main_name"]] = row["taxed_value_total"]
         output = []
         for m in sorted(combined.keys()):
             users = sorted(combined[m], key=lambda x: -combined[m][x])
@@ -0,0 +1,312 @@
+import datetime as dt
+from typing import Iterable, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+from django.db import models, transaction
+from django.db.models import Min, Sum
+from django.db.models.functions import TruncMonth
+from django.utils.timezone import make_aware
+from eveuniverse.models import EveSolarSystem
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from .. import __title__
+from ..helpers import PriceGroups
+from .character import Character, CharacterMiningLedgerEntry, CharacterTaxCredits
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+def first_of_month(date) -> dt.date:
+    if isinstance(date, dt.datetime):
+        date = date.date()
+    return date.replace(day=1)
+
+
+def _start_of_day(date) -> dt.datetime:
+    return make_aware(dt.datetime.combine(date, dt.time.min))
+
+
+def _month_range(months) -> Tuple[dt.date, dt.date]:
+    return min(months), max(months) + relativedelta(months=1)
+
+
+def _refresh_range(summaries, key_fields, calc_totals, in_scope) -> None:
+    """Recalculate the summaries of a key range while it is locked for update.
+
+    Args:
+    - summaries: Queryset of the key range
+    - key_fields: Model fields forming the keys of the totals
+    - calc_totals: Function returning a dict of key to field values
+    - in_scope: Function telling whether the summary of a key is refreshed,
+      so that it is deleted when missing from the totals
+    """
+
+    def key_of(obj):
+        return tuple(getattr(obj, field) for field in key_fields)
+
+    with transaction.atomic():
+        existing = {key_of(obj): obj for obj in summaries.select_for_update()}
+        totals = calc_totals()
+        tocreate = []
+        toupdate = []
+        for key, values in totals.items():
+            obj = existing.get(key)
+            if obj is None:
+                tocreate.append(summaries.model(**dict(zip(key_fields, key)), **values))
+            else:
+                for field, value in values.items():
+                    setattr(obj, field, value)
+                toupdate.append(obj)
+        if tocreate:
+            # Row locks do not cover missing keys on every database, so a
+            # concurrent refresh may have inserted one of them in the meantime
+            summaries.bulk_create(tocreate, batch_size=500, ignore_conflicts=True)
+            for obj in summaries.select_for_update():
+                key = key_of(obj)
+                if key in existing or key not in totals:
+                    continue
+                values = totals[key]
+                if any(getattr(obj, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(obj, field, value)
+                    toupdate.append(obj)
+        if toupdate:
+            summaries.bulk_update(
+                toupdate, list(next(iter(totals.values()))), batch_size=500
+            )
+        obsolete = [
+            obj.pk
+            for key, obj in existing.items()
+            if key not in totals and in_scope(key)
+        ]
+        if obsolete:
+            summaries.model.objects.filter(pk__in=obsolete).delete()
+
+
+class CharacterMonthlySummaryManager(models.Manager):
+    def refresh(self, keys: Iterable[Tuple[int, dt.date]]) -> None:
+        """Recalculate the summaries of the given (character PK, month) pairs
+        from the mining ledger and tax credits.
+        """
+        keys = {(character_pk, first_of_month(month)) for character_pk, month in keys}
+        if not keys:
+            return
+        character_pks = {character_pk for character_pk, _ in keys}
+        months = {month for _, month in keys}
+        start, end = _month_range(months)
+        _refresh_range(
+            self.filter(character_id__in=character_pks, month__in=months),
+            ("character_id", "month"),
+            lambda: self._totals(keys, character_pks, start, end),
+            lambda key: key in keys,
+        )
+
+    def _totals(self, keys, character_pks, start, end) -> dict:
+        totals = {}
+        for row in (
+            CharacterMiningLedgerEntry.objects.filter(
+                character_id__in=character_pks, date__gte=start, date__lt=end
+            )
+            .annotate(month=TruncMonth("date"))
+            .values("character_id", "month")
+            .annotate(
+                quantity_total=Sum("quantity"),
+                taxed_value_total=Sum("taxed_value"),
+                taxes_owed_total=Sum("taxes_owed"),
+            )
+        ):
+            key = (row["character_id"], first_of_month(row["month"]))
+            if key in keys:
+                totals[key] = {
+                    "quantity": row["quantity_total"],
+                    "taxed_value": row["taxed_value_total"],
+                    "taxes_owed": row["taxes_owed_total"],
+                    "credits": 0.0,
+                }
+        for row in (
+            CharacterTaxCredits.objects.filter(
+                character_id__in=character_pks,
+                date__gte=_start_of_day(start),
+                date__lt=_start_of_day(end),
+            )
+            .annotate(month=TruncMonth("date"))
+            .values("character_id", "month")
+            .annotate(credits_total=Sum("credit"))
+        ):
+            key = (row["character_id"], first_of_month(row["month"]))
+            if key in keys:
+                totals.setdefault(
+                    key, {"quantity": 0, "taxed_value": 0.0, "taxes_owed": 0.0}
+                )
+                totals[key]["credits"] = row["credits_total"]
+        return totals
+
+    def rebuild(self) -> None:
+        """Recalculate the summaries of all characters and months."""
+        keys = set(self.values_list("character_id", "month"))
+        for model in (CharacterMiningLedgerEntry, CharacterTaxCredits):
+            keys |= set(
+                model.objects.annotate(month=TruncMonth("date"))
+                .values_list("character_id", "month")
+                .distinct()
+            )
+        self.refresh(keys)
+
+    def monthly_by_main(self) -> models.QuerySet:
+        """Mining totals per main character and month of all characters
+        that have a main.
+        """
+        main_name = (
+            "character__eve_character__character_ownership__user__profile"
+            "__main_character__character_name"
+        )
+        return (
+            self.filter(quantity__gt=0, **{f"{main_name}__isnull": False})
+            .values("month", main_name=models.F(main_name))
+            .annotate(
+                taxed_value_total=Sum("taxed_value"),
+                taxes_owed_total=Sum("taxes_owed"),
+            )
+            .order_by("month")
+        )
+
+
+class CharacterMonthlySummary(models.Model):
+    """Mining and tax credits of a character in a month."""
+
+    character = models.ForeignKey(
+        Character, on_delete=models.CASCADE, related_name="monthly_summaries"
+    )
+    month = models.DateField(db_index=True)
+    quantity = models.BigIntegerField(default=0)
+    taxed_value = models.FloatField(default=0.0)
+    taxes_owed = models.FloatField(default=0.0)
+    credits = models.FloatField(default=0.0)
+
+    objects = CharacterMonthlySummaryManager()
+
+    class Meta:
+        default_permissions = ()
+        constraints = [
+            models.UniqueConstraint(
+                fields=["character", "month"],
+                name="functional_pk_mt_charactermonthlysummary",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.character} {self.month}"
+
+
+class SystemMonthlySummaryManager(models.Manager):
+    def refresh(self, keys: Iterable[Tuple[int, dt.date]]) -> None:
+        """Recalculate the summaries of the given (solar system ID, month) pairs
+        from the mining ledger of all characters.
+        """
+        keys = {(system_id, first_of_month(month)) for system_id, month in keys}
+        if not keys:
+            return
+        system_ids = {system_id for system_id, _ in keys}
+        months = {month for _, month in keys}
+        start, end = _month_range(months)
+        _refresh_range(
+            self.filter(eve_solar_system_id__in=system_ids, month__in=months),
+            ("eve_solar_system_id", "tax_group", "month"),
+            lambda: self._totals(keys, system_ids, start, end),
+            lambda key: (key[0], key[2]) in keys,
+        )
+
+    def _totals(self, keys, system_ids, start, end) -> dict:
+        totals = {}
+        for row in (
+            CharacterMiningLedgerEntry.objects.filter(
+                eve_solar_system_id__in=system_ids, date__gte=start, date__lt=end
+            )
+            .annotate(month=TruncMonth("date"))
+            .values("eve_solar_system_id", "month", "eve_type__eve_group_id")
+            .annotate(
+                quantity_total=Sum("quantity"),
+                taxed_value_total=Sum("taxed_value"),
+                taxes_owed_total=Sum("taxes_owed"),
+                first_date=Min("date"),
+            )
+        ):
+            month = first_of_month(row["month"])
+            tax_group = PriceGroups.taxgroups.get(row["eve_type__eve_group_id"])
+            if (row["eve_solar_system_id"], month) not in keys or tax_group is None:
+                continue
+            key = (row["eve_solar_system_id"], tax_group, month)
+            if key not in totals:
+                totals[key] = {
+                    "quantity": 0,
+                    "taxed_value": 0.0,
+                    "taxes_owed": 0.0,
+                    "first_date": row["first_date"],
+                }
+            totals[key]["quantity"] += row["quantity_total"]
+            totals[key]["taxed_value"] += row["taxed_value_total"]
+            totals[key]["taxes_owed"] += row["taxes_owed_total"]
+            totals[key]["first_date"] = min(
+                totals[key]["first_date"], row["first_date"]
+            )
+        return totals
+
+    def rebuild(self) -> None:
+        """Recalculate the summaries of all solar systems and months."""
+        keys = set(self.values_list("eve_solar_system_id", "month"))
+        keys |= set(
+            CharacterMiningLedgerEntry.objects.annotate(month=TruncMonth("date"))
+            .values_list("eve_solar_system_id", "month")
+            .distinct()
+        )
+        self.refresh(keys)
+
+
+class SystemMonthlySummary(models.Model):
+    """Mining of all characters in a solar system per tax group and month."""
+
+    eve_solar_system = models.ForeignKey(
+        EveSolarSystem, on_delete=models.CASCADE, related_name="+"
+    )
+    tax_group = models.CharField(max_length=32)
+    month = models.DateField(db_index=True)
+    quantity = models.BigIntegerField(default=0)
+    taxed_value = models.FloatField(default=0.0)
+    taxes_owed = models.FloatField(default=0.0)
+    first_date = models.DateField()
+
+    objects = SystemMonthlySummaryManager()
+
+    class Meta:
+        default_permissions = ()
+        constraints = [
+            models.UniqueConstraint(
+                fields=["eve_solar_system", "tax_group", "month"],
+                name="functional_pk_mt_systemmonthlysummary",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.eve_solar_system_id} {self.tax_group} {self.month}"
+
+
+def update_summaries(ledger_entries=(), credits=()) -> None:
+    """Update the summaries affected by changed ledger entries and tax credits."""
+    character_months = set()
+    system_months = set()
+    for entry in ledger_entries:
+        character_months.add((entry.character_id, first_of_month(entry.date)))
+        system_months.add((entry.eve_solar_system_id, first_of_month(entry.date)))
+    for credit in credits:
+        character_months.add((credit.character_id, first_of_month(credit.date)))
+    CharacterMonthlySummary.objects.refresh(character_months)
+    SystemMonthlySummary.objects.refresh(system_months)
+
+
+def rebuild_summaries() -> None:
+    """Recalculate all summaries, e.g. after rows were removed by cascades."""
+    CharacterMonthlySummary.objects.rebuild()
+    SystemMonthlySummary.objects.rebuild()
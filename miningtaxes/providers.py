@@ -1,10 +1,237 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, List
 
+import requests
+from bravado.exception import HTTPNotModified
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.core.cache import cache
 from esi.clients import EsiClientProvider
 
-from . import __version__
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__, __version__
+from .app_settings import (
+    MININGTAXES_ETAG_CACHE_TIMEOUT,
+    MININGTAXES_PRICE_CONCURRENCY,
+    MININGTAXES_PRICE_JANICE_API_KEY,
+    MININGTAXES_PRICE_MAX_RETRIES,
+    MININGTAXES_PRICE_METHOD,
+    MININGTAXES_PRICE_SOURCE_ID,
+    MININGTAXES_PRICE_TIMEOUT,
+)
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
 spec_file = Path(__file__).parent / "swagger.json"
 esi = EsiClientProvider(
     app_info_text=f"aa-memberaudit v{__version__}", spec_file=spec_file
 )
+
+
+def esi_results_if_modified(method, etag_key: str, **kwargs):
+    """Fetch all results of an ESI endpoint unless they have not changed
+    since the last call.
+
+    The ETag stored with store_etag() is sent as If-None-Match header.
+    Callers store the returned ETag only after they have saved the results,
+    so that results which failed to save are fetched again.
+
+    Args:
+    - method: ESI client method to call, e.g. esi.client.Industry.get_...
+    - etag_key: Cache key for storing the ETag of this request
+    - kwargs: Parameters for the ESI method
+
+    Returns:
+    - Tuple of the results and their ETag, or of None and None
+      when ESI responded with 304 Not Modified
+    """
+    etag = cache.get(etag_key)
+    if etag:
+        kwargs["_request_options"] = {"headers": {"If-None-Match": etag}}
+    operation = method(**kwargs)
+    operation.request_config.also_return_response = True
+    try:
+        results, response = operation.results()
+    except HTTPNotModified:
+        logger.debug("%s: Not modified", etag_key)
+        return None, None
+    headers = response.headers if response else {}
+    etag = headers.get("ETag")
+    if int(headers.get("X-Pages", 1)) > 1:
+        etag = None
+    return results, etag
+
+
+def store_etag(etag_key: str, etag: str = None) -> None:
+    """Store the ETag of saved ESI results or forget it when there is none."""
+    if etag:
+        cache.set(etag_key, etag, MININGTAXES_ETAG_CACHE_TIMEOUT)
+    else:
+        cache.delete(etag_key)
+
+
+MarketPrice = namedtuple("MarketPrice", ["buy", "sell"])
+"""Market price of a type: highest buy order and lowest sell order in ISK."""
+
+
+class PriceProvider:
+    """Base class for clients fetching market prices from a pricing API.
+
+    Type IDs are requested in chunks, which are fetched concurrently
+    through a shared pooled session that retries failed requests with backoff.
+    """
+
+    name = ""
+    base_url = ""
+    chunk_size = 1000
+
+    def __init__(
+        self,
+        base_url: str = None,
+        timeout: float = MININGTAXES_PRICE_TIMEOUT,
+        concurrency: int = MININGTAXES_PRICE_CONCURRENCY,
+        max_retries: int = MININGTAXES_PRICE_MAX_RETRIES,
+        backoff_factor: float = 0.5,
+    ) -> None:
+        if base_url:
+            self.base_url = base_url
+        self.base_url = self.base_url.rstrip("/")
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=1,
+            pool_maxsize=self.concurrency,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __str__(self) -> str:
+        return self.name
+
+    def is_available(self) -> bool:
+        """Return True when the API can be used with the current configuration."""
+        return True
+
+    def get_prices(self, type_ids: Iterable[int]) -> Dict[int, MarketPrice]:
+        """Fetch market prices for the given type IDs.
+
+        Types without market data are missing from the result.
+        """
+        type_ids = sorted(set(type_ids))
+        chunks = [
+            type_ids[i : i + self.chunk_size]
+            for i in range(0, len(type_ids), self.chunk_size)
+        ]
+        prices = {}
+        if not chunks:
+            return prices
+        with ThreadPoolExecutor(
+            max_workers=min(self.concurrency, len(chunks))
+        ) as executor:
+            for result in executor.map(self._fetch_chunk, chunks):
+                prices.update(result)
+        logger.debug("%s: Fetched prices for %d types", self, len(prices))
+        return prices
+
+    def _fetch_chunk(self, type_ids: List[int]) -> Dict[int, MarketPrice]:
+        raise NotImplementedError()
+
+
+class FuzzworkPriceProvider(PriceProvider):
+    """Prices from the Fuzzwork market aggregates API."""
+
+    name = "Fuzzwork"
+    base_url = "https://market.fuzzwork.co.uk"
+
+    def __init__(self, *args, station_id: int = MININGTAXES_PRICE_SOURCE_ID, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.station_id = station_id
+
+    def _fetch_chunk(self, type_ids: List[int]) -> Dict[int, MarketPrice]:
+        response = self.session.get(
+            f"{self.base_url}/aggregates/",
+            params={
+                "types": ",".join(str(x) for x in type_ids),
+                "station": self.station_id,
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return {
+            int(type_id): MarketPrice(
+                buy=float(data["buy"]["max"]), sell=float(data["sell"]["min"])
+            )
+            for type_id, data in response.json().items()
+        }
+
+
+class JanicePriceProvider(PriceProvider):
+    """Prices from the Janice pricer API for Jita 4-4."""
+
+    name = "Janice"
+    base_url = "https://janice.e-351.com"
+
+    def __init__(
+        self, *args, api_key: str = MININGTAXES_PRICE_JANICE_API_KEY, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.session.headers.update({"X-ApiKey": api_key, "accept": "application/json"})
+
+    def is_available(self) -> bool:
+        response = self.session.get(
+            f"{self.base_url}/api/rest/v2/markets", timeout=self.timeout
+        )
+        data = response.json()
+        if "status" in data:
+            logger.debug("Janice API status: %s", data)
+            return False
+        return True
+
+    def _fetch_chunk(self, type_ids: List[int]) -> Dict[int, MarketPrice]:
+        response = self.session.post(
+            f"{self.base_url}/api/rest/v2/pricer",
+            params={"market": 2},
+            data="\n".join(str(x) for x in type_ids),
+            headers={"Content-Type": "text/plain"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return {
+            int(item["itemType"]["eid"]): MarketPrice(
+                buy=float(item["top5AveragePrices"]["buyPrice5DayMedian"]),
+                sell=float(item["top5AveragePrices"]["sellPrice5DayMedian"]),
+            )
+            for item in response.json()
+        }
+
+
+PRICE_PROVIDERS = {
+    provider.name: provider for provider in (FuzzworkPriceProvider, JanicePriceProvider)
+}
+
+
+def price_provider(method: str = MININGTAXES_PRICE_METHOD, **kwargs) -> PriceProvider:
+    """Return a client for the given pricing method.
+
+    Raises:
+    - ValueError: for unknown pricing methods
+    """
+    try:
+        provider_class = PRICE_PROVIDERS[method]
+    except KeyError:
+        raise ValueError(f"Unknown pricing method: {method}") from None
+    return provider_class(**kwargs)
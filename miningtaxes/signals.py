@@ -0,0 +1,58 @@
+import threading
+
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models.character import (
+    Character,
+    CharacterMiningLedgerEntry,
+    CharacterTaxCredits,
+    bump_ledger_version,
+    credits_changed,
+    ledger_changed,
+)
+from .models.summaries import SystemMonthlySummary
+
+# PKs of characters currently being deleted by this thread
+_deleting = threading.local()
+
+
+def _deleting_pks() -> set:
+    if not hasattr(_deleting, "pks"):
+        _deleting.pks = set()
+    return _deleting.pks
+
+
+@receiver(pre_delete, sender=Character)
+def character_pre_delete(sender, instance, **kwargs):
+    """Remember the solar system months of a character about to be deleted,
+    so its cascaded ledger entries need not be handled one by one.
+    """
+    instance._summary_system_months = set(
+        instance.mining_ledger.annotate(month=TruncMonth("date"))
+        .values_list("eve_solar_system_id", "month")
+        .distinct()
+    )
+    _deleting_pks().add(instance.pk)
+
+
+@receiver(post_delete, sender=Character)
+def character_post_delete(sender, instance, **kwargs):
+    _deleting_pks().discard(instance.pk)
+    bump_ledger_version()
+    SystemMonthlySummary.objects.refresh(
+        getattr(instance, "_summary_system_months", set())
+    )
+
+
+@receiver(post_delete, sender=CharacterMiningLedgerEntry)
+def ledger_entry_post_delete(sender, instance, **kwargs):
+    if instance.character_id not in _deleting_pks():
+        ledger_changed([instance])
+
+
+@receiver(post_delete, sender=CharacterTaxCredits)
+def tax_credit_post_delete(sender, instance, **kwargs):
+    if instance.character_id not in _deleting_pks():
+        credits_changed([instance])
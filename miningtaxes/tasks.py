@@ -1,23 +1,22 @@
+from uuid import uuid4
+
 import requests
-from celery import shared_task
+from celery import chain, shared_task, signature
 
+from django.core.cache import cache
 from django.db import Error
-from django.http.response import Http404
-from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from eveuniverse.models import EveType, EveTypeMaterial
 
-from allianceauth.eveonline.models import EveCharacter
 from allianceauth.notifications import notify
 from allianceauth.services.hooks import get_extension_logger
 
 from .app_settings import (
-    MININGTAXES_PRICE_JANICE_API_KEY,
-    MININGTAXES_PRICE_METHOD,
-    MININGTAXES_PRICE_SOURCE_ID,
     MININGTAXES_PRICE_SOURCE_NAME,
     MININGTAXES_TASKS_TIME_LIMIT,
     MININGTAXES_TAX_ONLY_CORP_MOONS,
+    MININGTAXES_UPDATE_CHUNK_SIZE,
+    MININGTAXES_UPDATE_CONCURRENCY,
 )
 from .helpers import PriceGroups
 from .models import (
@@ -27,35 +26,19 @@ from .models import (
     Character,
     OrePrices,
     Settings,
+    StaticDataFingerprint,
     Stats,
 )
+from .providers import price_provider
 
 logger = get_extension_logger(__name__)
 TASK_DEFAULT_KWARGS = {"time_limit": MININGTAXES_TASKS_TIME_LIMIT, "max_retries": 3}
+STAGE_TIMEOUT = 6 * 3600
+"""Seconds after which a stage of the daily update is given up as stuck."""
 
 
 def calctaxes():
-    s = Stats.load()
-    return s.calctaxes()
-
-
-def get_user(cid):
-    try:
-        c = EveCharacter.objects.get(character_id=cid)
-        p = c.character_ownership.user.profile
-    except Exception:
-        return None
-    if p is None or p.main_character is None:
-        return None
-    found = None
-    for c in p.user.character_ownerships.all():
-        try:
-            payee = get_object_or_404(Character, eve_character_id=c.character.pk)
-        except Exception:
-            continue
-        found = payee
-        break
-    return found
+    return Character.objects.user_balances()
 
 
 @shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
@@ -91,87 +74,198 @@ def apply_interest(self):
             notify(user=u, title=title, message=message, level="WARN")
 
 
+def chunks(items, size):
+    """Split items into lists of at most size elements."""
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def lanes(tasks, concurrency):
+    """Distribute tasks round robin over at most concurrency lists."""
+    return [tasks[i::concurrency] for i in range(min(concurrency, len(tasks)))]
+
+
+def run_stage(subtasks, next_task):
+    """Run subtasks in parallel chains and start next_task once all have finished.
+
+    Completion is counted in the cache, so that no Celery result backend
+    is needed. A chain stopped by a failing subtask is counted as finished
+    by its error callback. If chains are still missing after STAGE_TIMEOUT,
+    e.g. because a worker was lost, the stage is given up and next_task
+    is started anyway.
+    """
+    if not subtasks:
+        next_task.delay()
+        return
+    stage_lanes = lanes(subtasks, MININGTAXES_UPDATE_CONCURRENCY)
+    stage_key = f"miningtaxes-daily-stage-{uuid4().hex}"
+    cache.set(stage_key, len(stage_lanes), timeout=2 * STAGE_TIMEOUT)
+    for lane in stage_lanes:
+        finish = finish_stage.si(stage_key=stage_key, next_task=next_task)
+        on_error = fail_stage_lane.s(stage_key=stage_key, next_task=next_task)
+        chain(*lane, finish).on_error(on_error).delay()
+    check_stage.apply_async(
+        kwargs={"stage_key": stage_key, "next_task": next_task},
+        countdown=STAGE_TIMEOUT,
+    )
+
+
+def _start_next_task(stage_key, next_task) -> None:
+    # Deleting the counter claims the stage, so next_task is started only once
+    if cache.delete(stage_key):
+        signature(next_task).delay()
+
+
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def finish_stage(self, stage_key, next_task):
+    """Count down the chains of a stage and start the next task after the last."""
+    if cache.get(stage_key) is None:
+        logger.warning("Daily update stage %s has already been given up", stage_key)
+        return
+    if cache.decr(stage_key) <= 0:
+        _start_next_task(stage_key, next_task)
+
+
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def fail_stage_lane(self, task_id, stage_key, next_task):
+    """Count a chain stopped by a failing subtask as finished.
+
+    Called by Celery with the ID of the failed subtask.
+    """
+    logger.error(
+        "Daily update subtask %s failed, skipping the rest of its chain", task_id
+    )
+    finish_stage(stage_key=stage_key, next_task=next_task)
+
+
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def check_stage(self, stage_key, next_task):
+    """Start the next task of a stage that has not finished in time."""
+    remaining = cache.get(stage_key)
+    if remaining is None:
+        return
+    logger.error(
+        "Daily update stage %s is missing %d chains after %d seconds, "
+        "starting the next task anyway",
+        stage_key,
+        remaining,
+        STAGE_TIMEOUT,
+    )
+    _start_next_task(stage_key, next_task)
+
+
 @shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
 def update_daily(self):
+    """Run the daily update as a workflow of parallel subtasks.
+
+    Corp data of all admin characters is pulled first, then the mining ledgers
+    of all characters in chunks and finally all taxes and stats are aggregated.
+    """
+    update_all_prices()
+    admin_pks = list(AdminCharacter.objects.values_list("pk", flat=True))
+    run_stage(
+        [
+            update_admin_characters_chunk.si(character_pks=pks)
+            for pks in chunks(admin_pks, 1)
+        ],
+        update_daily_characters.si(),
+    )
+
+
+def update_daily_serial():
+    """Run all steps of the daily update one after the other in this process."""
     update_all_prices()
-    characters = AdminCharacter.objects.all()
-    for character in characters:
-        update_admin_character(character_pk=character.id, celery=True)
-    characters = Character.objects.all()
-    for character in characters:
-        update_character(character_pk=character.id, celery=True)
+    update_admin_characters_chunk(
+        list(AdminCharacter.objects.values_list("pk", flat=True))
+    )
+    character_pks = list(Character.objects.values_list("pk", flat=True))
+    update_characters_chunk(character_pks)
     add_corp_moon_taxes()
     add_tax_credits()
-    # precalc all characters
-    for character in characters:
-        character.precalc_all()
-    s = Stats.load()
-    s.precalc_all()
+    precalc_characters_chunk(character_pks)
+    precalc_stats()
+
 
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def update_admin_characters_chunk(self, character_pks):
+    for character_pk in character_pks:
+        try:
+            update_admin_character(character_pk=character_pk, celery=True)
+        except Exception:
+            logger.exception("Failed to update admin character %s", character_pk)
 
-def valid_janice_api_key():
-    c = requests.get(
-        "https://janice.e-351.com/api/rest/v2/markets",
-        headers={
-            "Content-Type": "text/plain",
-            "X-ApiKey": MININGTAXES_PRICE_JANICE_API_KEY,
-            "accept": "application/json",
-        },
-    ).json()
 
-    if "status" in c:
-        logger.debug("Janice API status: %s" % c)
-        return False
-    else:
-        return True
-
-
-def get_bulk_prices(type_ids):
-    r = None
-    if MININGTAXES_PRICE_METHOD == "Fuzzwork":
-        r = requests.get(
-            "https://market.fuzzwork.co.uk/aggregates/",
-            params={
-                "types": ",".join([str(x) for x in type_ids]),
-                "station": MININGTAXES_PRICE_SOURCE_ID,
-            },
-        ).json()
-    elif MININGTAXES_PRICE_METHOD == "Janice":
-        r = requests.post(
-            "https://janice.e-351.com/api/rest/v2/pricer?market=2",
-            data="\n".join([str(x) for x in type_ids]),
-            headers={
-                "Content-Type": "text/plain",
-                "X-ApiKey": MININGTAXES_PRICE_JANICE_API_KEY,
-                "accept": "application/json",
-            },
-        ).json()
-
-        # Make Janice data look like Fuzzworks
-        output = {}
-        for item in r:
-            output[str(item["itemType"]["eid"])] = {
-                "buy": {"max": str(item["top5AveragePrices"]["buyPrice5DayMedian"])},
-                "sell": {"min": str(item["top5AveragePrices"]["sellPrice5DayMedian"])},
-            }
-        r = output
-    else:
-        raise f"Unknown pricing method: {MININGTAXES_PRICE_METHOD}"
-    return r
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def update_daily_characters(self):
+    character_pks = list(Character.objects.values_list("pk", flat=True))
+    subtasks = [
+        update_characters_chunk.si(character_pks=pks)
+        for pks in chunks(character_pks, MININGTAXES_UPDATE_CHUNK_SIZE)
+    ]
+    logger.info(
+        "Updating %d characters in %d subtasks", len(character_pks), len(subtasks)
+    )
+    run_stage(subtasks, update_daily_aggregate.si())
 
 
 @shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
-def update_all_prices(self):
-    type_ids = []
-    market_data = {}
-    api_up = True
+def update_characters_chunk(self, character_pks):
+    for character_pk in character_pks:
+        try:
+            update_character(character_pk=character_pk, celery=True)
+        except Exception:
+            logger.exception("Failed to update character %s", character_pk)
 
-    # Get all type ids
-    prices = PriceGroups().items
 
-    # Update EveUniverse objects
-    matset = set()
-    for item in prices:
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def update_daily_aggregate(self):
+    try:
+        add_corp_moon_taxes()
+    except Exception:
+        logger.exception("Failed to add corp moon taxes")
+    try:
+        add_tax_credits()
+    except Exception:
+        logger.exception("Failed to add tax credits")
+    character_pks = list(Character.objects.values_list("pk", flat=True))
+    run_stage(
+        [
+            precalc_characters_chunk.si(character_pks=pks)
+            for pks in chunks(character_pks, MININGTAXES_UPDATE_CHUNK_SIZE)
+        ],
+        precalc_stats.si(),
+    )
+
+
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def precalc_characters_chunk(self, character_pks):
+    for character in Character.objects.filter(pk__in=character_pks):
+        try:
+            character.precalc_all()
+        except Exception:
+            logger.exception("Failed to precalc character %s", character.pk)
+
+
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def precalc_stats(self):
+    s = Stats.load()
+    s.precalc_all()
+
+
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def update_static_data(self, force_update: bool = False):
+    """Load types and their materials from ESI for all priced types.
+
+    Args:
+    - force_update: When set to True will reload types that are already loaded
+    """
+    loaded = set(StaticDataFingerprint.objects.values_list("eve_type_id", flat=True))
+    items = [
+        item
+        for item in PriceGroups.load().items
+        if force_update or item.id not in loaded
+    ]
+    logger.info("Loading static data for %d types", len(items))
+    for item in items:
         EveType.objects.update_or_create_esi(
             id=item.id,
             enabled_sections=EveType.Section.TYPE_MATERIALS,
@@ -179,100 +273,74 @@ def update_all_prices(self):
             wait_for_children=True,
         )
         EveTypeMaterial.objects.update_or_create_api(eve_type=item)
+        fingerprint = StaticDataFingerprint.calc_fingerprint(item.id)
+        obj, created = StaticDataFingerprint.objects.get_or_create(
+            eve_type_id=item.id,
+            defaults={"fingerprint": fingerprint, "loaded_at": timezone.now()},
+        )
+        if not created:
+            if obj.fingerprint != fingerprint:
+                logger.info("Static data has changed for %s", item)
+            obj.fingerprint = fingerprint
+            obj.loaded_at = timezone.now()
+            obj.save()
+    if items:
+        PriceGroups.invalidate()
 
-        materials = EveTypeMaterial.objects.filter(
-            eve_type_id=item.id
-        ).prefetch_related("eve_type")
-        for mat in materials:
-            mat = mat.material_eve_type
-            matset.add(mat.id)
 
-    if MININGTAXES_PRICE_METHOD == "Fuzzwork":
-        logger.debug(
-            "Price setup starting for %s items from Fuzzworks API from station id %s (%s), this may take up to 30 seconds..."
-            % (
-                len(prices),
-                MININGTAXES_PRICE_SOURCE_ID,
-                MININGTAXES_PRICE_SOURCE_NAME,
-            )
-        )
-    elif MININGTAXES_PRICE_METHOD == "Janice":
-        if valid_janice_api_key():
-            logger.debug(
-                "Price setup starting for %s items from Janice API for Jita 4-4, this may take up to 30 seconds..."
-                % (len(prices),)
-            )
-        else:
-            logger.debug(
-                "Price setup failed for Janice, invalid API key! Provide a working key or change price source to Fuzzwork"
-            )
-            api_up = False
-    else:
-        logger.error(
-            "Unknown pricing method: '%s', skipping" % MININGTAXES_PRICE_METHOD
-        )
-        return
+@shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
+def update_all_prices(self):
+    # Get all type ids
+    prices = PriceGroups.load().items
+
+    # Load static data of new types only
+    update_static_data()
+    matset = set(
+        EveTypeMaterial.objects.filter(
+            eve_type_id__in=[item.id for item in prices]
+        ).values_list("material_eve_type_id", flat=True)
+    )
+    type_ids = {item.id for item in prices} | matset
 
-    if api_up:
-        # Build suitable bulks to fetch prices from API
-        for item in prices:
-            type_ids.append(item.id)
+    try:
+        provider = price_provider()
+    except ValueError as e:
+        logger.error("%s, skipping", e)
+        return
 
-            if len(type_ids) == 1000:
-                market_data.update(get_bulk_prices(type_ids))
-                type_ids.clear()
+    try:
+        api_up = provider.is_available()
+    except requests.RequestException as e:
+        logger.debug("Price source %s not reachable: %s", provider, e)
+        api_up = False
 
-        # Get leftover data from the bulk
-        if len(type_ids) > 0:
-            market_data.update(get_bulk_prices(type_ids))
+    if api_up:
+        logger.debug(
+            "Price setup starting for %s items from %s API (%s)..."
+            % (len(prices), provider, MININGTAXES_PRICE_SOURCE_NAME)
+        )
+        try:
+            market_data = provider.get_prices(type_ids)
+        except requests.RequestException as e:
+            logger.error("Error fetching prices from %s: %s" % (provider, e))
+            return
 
         logger.debug("Market data fetched, starting database update...")
-        existing = OrePrices.objects.all()
-        toupdate = []
-        tocreate = []
-        for price in prices:
-            if not str(price.id) in market_data:
-                logger.debug(f"Missing data on {price}")
-                continue
-            if price.id in matset:
+        new_prices = {}
+        for type_id in type_ids:
+            if type_id not in market_data:
+                logger.debug(f"Missing data on {type_id}")
                 continue
-            buy = int(float(market_data[str(price.id)]["buy"]["max"]))
-            sell = int(float(market_data[str(price.id)]["sell"]["min"]))
-            now = timezone.now()
-
-            found = None
-            for e in existing:
-                if price.id == e.eve_type.id:
-                    found = e
-                    break
-            if found is not None:
-                found.buy = buy
-                found.sell = sell
-                found.updated = now
-                toupdate.append(found)
-            else:
-                tocreate.append(
-                    OrePrices(eve_type_id=price.id, buy=buy, sell=sell, updated=now)
-                )
+            new_prices[type_id] = market_data[type_id]
 
-        # Handling refined material prices
-        logger.debug("Materials price updating...")
-        type_ids = list(matset)
-        market_data = {}
-        market_data.update(get_bulk_prices(type_ids))
-        for mat in matset:
-            if not str(mat) in market_data:
-                logger.debug(f"Missing data on {mat}")
-                continue
-            buy = int(float(market_data[str(mat)]["buy"]["max"]))
-            sell = int(float(market_data[str(mat)]["sell"]["min"]))
-            now = timezone.now()
-
-            found = None
-            for e in existing:
-                if mat == e.eve_type.id:
-                    found = e
-                    break
+        existing = {ore.eve_type_id: ore for ore in OrePrices.objects.all()}
+        now = timezone.now()
+        toupdate = []
+        tocreate = []
+        for type_id, market_price in new_prices.items():
+            buy = int(market_price.buy)
+            sell = int(market_price.sell)
+            found = existing.get(type_id)
             if found is not None:
                 found.buy = buy
                 found.sell = sell
@@ -280,21 +348,21 @@ def update_all_prices(self):
                 toupdate.append(found)
             else:
                 tocreate.append(
-                    OrePrices(eve_type_id=mat, buy=buy, sell=sell, updated=now)
+                    OrePrices(eve_type_id=type_id, buy=buy, sell=sell, updated=now)
                 )
 
         logger.debug("Objects to be created: %d" % len(tocreate))
         logger.debug("Objects to be updated: %d" % len(toupdate))
         try:
-            OrePrices.objects.bulk_create(tocreate)
-            OrePrices.objects.bulk_update(toupdate, ["buy", "sell", "updated"])
+            OrePrices.objects.bulk_create(tocreate, batch_size=500)
+            OrePrices.objects.bulk_update(
+                toupdate, ["buy", "sell", "updated"], batch_size=500
+            )
             logger.debug("All prices succesfully updated")
         except Error as e:
             logger.error("Error updating prices: %s" % e)
 
-        existing = OrePrices.objects.all()
-        for e in existing:
-            e.calc_prices()
+        OrePrices.objects.calc_prices()
     else:
         logger.error("Price source API is not up! Prices not updated.")
 
@@ -335,63 +403,24 @@ def update_admin_character(
 
 def add_tax_credits():
     settings = Settings.load()
-    characters = AdminCharacter.objects.all()
-    phrase = settings.phrase.lower().strip()
-    for character in characters:
-        entries = character.corp_ledger.all()
-        for entry in entries:
-            if phrase != "" and phrase not in entry.reason.lower():
-                continue
-            try:
-                payee = get_object_or_404(
-                    Character,
-                    eve_character_id=EveCharacter.objects.get(
-                        character_id=entry.taxed_id
-                    ).pk,
-                )
-            except EveCharacter.DoesNotExist:
-                payee = get_user(entry.taxed_id)
-                if payee is None:
-                    continue
-                pass
-            except Http404:
-                continue
-            payee.tax_credits.update_or_create(
-                date=entry.date, credit=entry.amount, defaults={"credit_type": "paid"}
-            )
+    AdminMiningCorpLedgerEntry.objects.add_tax_credits(settings.phrase)
 
 
 def add_tax_credits_by_char(character):
     settings = Settings.load()
-    entries = AdminMiningCorpLedgerEntry.objects.filter(
+    AdminMiningCorpLedgerEntry.objects.filter(
         taxed_id=character.eve_character.character_id
-    )
-    for entry in entries:
-        if settings.phrase != "" and settings.phrase not in entry.reason:
-            continue
-        character.tax_credits.update_or_create(
-            date=entry.date, credit=entry.amount, defaults={"credit_type": "paid"}
-        )
+    ).add_tax_credits(settings.phrase)
 
 
 def add_corp_moon_taxes():
-    characters = Character.objects.all()
-    for character in characters:
-        add_corp_moon_taxes_by_char(character)
+    AdminMiningObsLog.objects.add_to_mining_ledgers()
 
 
 def add_corp_moon_taxes_by_char(character):
-    entries = AdminMiningObsLog.objects.filter(
-        miner_id=character.eve_character.character_id
+    AdminMiningObsLog.objects.add_to_mining_ledgers(
+        Character.objects.filter(pk=character.pk)
     )
-    for entry in entries:
-        (row, _) = character.mining_ledger.update_or_create(
-            date=entry.date,
-            eve_solar_system=entry.eve_solar_system,
-            eve_type=entry.eve_type,
-            defaults={"quantity": entry.quantity},
-        )
-        row.calc_prices()
 
 
 @shared_task(**{**TASK_DEFAULT_KWARGS, **{"bind": True}})
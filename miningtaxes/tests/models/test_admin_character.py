@@ -1,13 +1,29 @@
-from unittest.mock import patch
+import datetime as dt
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.utils.timezone import now
 
 from allianceauth.eveonline.models import EveCharacter
 from app_utils.testing import NoSocketsTestCase, add_new_token
 
-from ...models import AdminCharacter
+from ...models import (
+    AdminCharacter,
+    AdminMiningCorpLedgerEntry,
+    AdminMiningObsLog,
+    AdminMiningStructure,
+    OrePrices,
+)
+from ...providers import esi_results_if_modified
 from ..testdata.esi_client_stub import esi_client_stub
 from ..testdata.load_entities import load_entities
 from ..testdata.load_eveuniverse import load_eveuniverse
-from ..utils import create_character, create_miningtaxes_admincharacter
+from ..utils import (
+    add_auth_character_to_user,
+    create_character,
+    create_miningtaxes_admincharacter,
+    create_miningtaxes_character,
+)
 
 MODELS_PATH = "miningtaxes.models"
 
@@ -71,3 +87,285 @@ class TestAdminCharacter(NoSocketsTestCase):
         self.assertEqual(entry.miner_id, 1001)
         self.assertEqual(entry.quantity, 100)
         self.assertEqual(entry.eve_type_id, 45511)
+
+    @patch(MODELS_PATH + ".admin.esi")
+    def test_mining_observers_unchanged(self, mock_esi):
+        mock_esi.client = esi_client_stub
+        # given
+        character_1001 = create_miningtaxes_admincharacter(1001)
+        user = character_1001.eve_character.character_ownership.user
+        add_new_token(
+            user, character_1001.eve_character, AdminCharacter.get_esi_scopes()
+        )
+        character_1001.update_mining_observers()
+        obs = character_1001.mining_obs.get()
+        obs.mining_log.update(quantity=1)
+        # when
+        character_1001.update_mining_observers()
+        # then
+        obs.refresh_from_db()
+        self.assertNotEqual(obs.content_hash, "")
+        self.assertEqual(obs.mining_log.count(), 1)
+        self.assertEqual(obs.mining_log.get().quantity, 1)
+
+    @patch(MODELS_PATH + ".admin.esi")
+    def test_mining_observers_fetch_logs_when_list_unchanged(self, mock_esi):
+        mock_esi.client = esi_client_stub
+        # given
+        character_1001 = create_miningtaxes_admincharacter(1001)
+        user = character_1001.eve_character.character_ownership.user
+        add_new_token(
+            user, character_1001.eve_character, AdminCharacter.get_esi_scopes()
+        )
+        character_1001.update_mining_observers()
+        obs = character_1001.mining_obs.get()
+        obs.mining_log.update(quantity=1)
+        obs.content_hash = ""
+        obs.save()
+        observers_method = (
+            esi_client_stub.Industry.get_corporation_corporation_id_mining_observers
+        )
+
+        def results_if_modified(method, etag_key, **kwargs):
+            if method == observers_method:
+                return None, None
+            return esi_results_if_modified(method, etag_key, **kwargs)
+
+        # when
+        with patch(
+            MODELS_PATH + ".admin.esi_results_if_modified",
+            side_effect=results_if_modified,
+        ):
+            character_1001.update_mining_observers()
+        # then
+        self.assertEqual(obs.mining_log.get().quantity, 100)
+
+    @patch(MODELS_PATH + ".admin.esi")
+    def test_corp_ledger_etag_per_admin_character(self, mock_esi):
+        mock_esi.client = esi_client_stub
+        # given
+        characters = []
+        for character_id in [1001, 1002]:
+            character = create_miningtaxes_admincharacter(character_id)
+            add_new_token(
+                character.eve_character.character_ownership.user,
+                character.eve_character,
+                AdminCharacter.get_esi_scopes(),
+            )
+            characters.append(character)
+
+        def results_if_modified(method, etag_key, **kwargs):
+            if cache.get(etag_key):
+                return None, None
+            results, _ = esi_results_if_modified(method, etag_key, **kwargs)
+            return results, "abc"
+
+        # when
+        with patch(
+            MODELS_PATH + ".admin.esi_results_if_modified",
+            side_effect=results_if_modified,
+        ):
+            for character in characters:
+                character.update_corp_ledger()
+        # then
+        for character in characters:
+            character.refresh_from_db()
+            self.assertEqual(character.corp_ledger_last_id, 12345)
+            self.assertEqual(character.corp_ledger.count(), 1)
+
+    @patch(MODELS_PATH + ".admin.esi")
+    def test_corp_ledger_incremental(self, mock_esi):
+        mock_esi.client = esi_client_stub
+        # given
+        character_1001 = create_miningtaxes_admincharacter(1001)
+        user = character_1001.eve_character.character_ownership.user
+        add_new_token(
+            user, character_1001.eve_character, AdminCharacter.get_esi_scopes()
+        )
+        character_1001.update_corp_ledger()
+        character_1001.corp_ledger.all().delete()
+        # when
+        character_1001.update_corp_ledger()
+        # then
+        character_1001.refresh_from_db()
+        self.assertEqual(character_1001.corp_ledger_last_id, 12345)
+        self.assertEqual(character_1001.corp_ledger_corporation_id, 2001)
+        self.assertEqual(character_1001.corp_ledger.count(), 0)
+
+
+class TestAdminMiningStructure(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+
+    @patch(MODELS_PATH + ".admin.esi")
+    def test_fetch_caches_structures_and_errors(self, mock_esi):
+        mock_esi.client = esi_client_stub
+        # when
+        structures = AdminMiningStructure.objects.fetch([123456789, 987], "token")
+        # then
+        self.assertEqual(list(structures.keys()), [123456789])
+        self.assertEqual(structures[123456789].eve_solar_system_id, 30002537)
+        self.assertEqual(
+            AdminMiningStructure.objects.get(structure_id=987).error_status, 404
+        )
+
+        # when fetched again
+        mock_esi.client = Mock(side_effect=RuntimeError)
+        structures = AdminMiningStructure.objects.fetch([123456789, 987], "token")
+        # then
+        self.assertEqual(list(structures.keys()), [123456789])
+        self.assertFalse(mock_esi.client.Universe.mock_calls)
+
+
+class TestAdminMiningCorpLedgerEntry(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def test_add_tax_credits(self):
+        # given
+        admin_character = create_miningtaxes_admincharacter(1003)
+        character_1001 = create_miningtaxes_character(1001)
+        add_auth_character_to_user(character_1001.user, 1002)
+        today = now().replace(microsecond=0)
+        for days, taxed_id, amount, reason in [
+            (1, 1001, 100.0, "Mining Tax"),
+            (2, 1002, 200.0, "tax"),
+            (3, 1001, 300.0, "gift"),
+            (4, 999999, 400.0, "tax"),
+        ]:
+            admin_character.corp_ledger.create(
+                date=today - dt.timedelta(days=days),
+                taxed_id=taxed_id,
+                amount=amount,
+                reason=reason,
+            )
+        # when
+        created = AdminMiningCorpLedgerEntry.objects.add_tax_credits(" TAX ")
+        # then
+        self.assertEqual(len(created), 2)
+        self.assertEqual(
+            sorted(character_1001.tax_credits.values_list("credit", flat=True)),
+            [100.0, 200.0],
+        )
+        self.assertEqual(AdminMiningCorpLedgerEntry.objects.add_tax_credits("tax"), [])
+        self.assertEqual(character_1001.tax_credits.count(), 2)
+
+
+class TestAdminMiningObsLog(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def test_add_to_mining_ledgers(self):
+        # given
+        admin_character = create_miningtaxes_admincharacter(1003)
+        character_1001 = create_miningtaxes_character(1001)
+        OrePrices(eve_type_id=45511, buy=10, sell=100, updated=now()).calc_prices()
+        observers = [
+            admin_character.mining_obs.create(
+                obs_id=obs_id, obs_type="moon", name="Moon", sys_name="Jita"
+            )
+            for obs_id in [1, 2]
+        ]
+        day_1 = dt.date(2022, 1, 1)
+        day_2 = dt.date(2022, 1, 2)
+        for observer, date, miner_id, quantity in [
+            (observers[0], day_1, 1001, 10),
+            (observers[1], day_1, 1001, 5),
+            (observers[0], day_2, 1001, 7),
+            (observers[0], day_2, 1002, 100),
+        ]:
+            observer.mining_log.create(
+                date=date,
+                miner_id=miner_id,
+                eve_type_id=45511,
+                eve_solar_system_id=30000142,
+                quantity=quantity,
+            )
+        # when
+        AdminMiningObsLog.objects.add_to_mining_ledgers()
+        # then
+        self.assertEqual(
+            dict(character_1001.mining_ledger.values_list("date", "quantity")),
+            {day_1: 15, day_2: 7},
+        )
+        self.assertTrue(character_1001.mining_ledger.filter(taxes_owed__gt=0).exists())
+        character_1001.refresh_from_db()
+        self.assertIsNotNone(character_1001.moon_log_updated_at)
+
+    def test_add_to_mining_ledgers_only_changed_days(self):
+        # given
+        admin_character = create_miningtaxes_admincharacter(1003)
+        character_1001 = create_miningtaxes_character(1001)
+        observer = admin_character.mining_obs.create(
+            obs_id=1, obs_type="moon", name="Moon", sys_name="Jita"
+        )
+        day_1 = dt.date(2022, 1, 1)
+        day_2 = dt.date(2022, 1, 2)
+        for date, hours in [(day_1, 2), (day_2, 1)]:
+            observer.mining_log.create(
+                date=date,
+                miner_id=1001,
+                eve_type_id=45511,
+                eve_solar_system_id=30000142,
+                quantity=10,
+                updated_at=now() - dt.timedelta(hours=hours),
+            )
+        AdminMiningObsLog.objects.add_to_mining_ledgers()
+        observer.mining_log.update(quantity=20)  # without updated_at
+        AdminMiningObsLog.objects.bulk_upsert(
+            observer,
+            observer.mining_log.first().eve_solar_system,
+            {(day_2, 1001, 45511): 30},
+        )
+        # when
+        entries = AdminMiningObsLog.objects.add_to_mining_ledgers()
+        # then
+        self.assertEqual([entry.date for entry in entries], [day_2])
+        self.assertEqual(
+            dict(character_1001.mining_ledger.values_list("date", "quantity")),
+            {day_1: 10, day_2: 30},
+        )
+
+    def test_add_to_mining_ledgers_late_older_entries(self):
+        # given
+        admin_character = create_miningtaxes_admincharacter(1003)
+        character_1001 = create_miningtaxes_character(1001)
+        observers = [
+            admin_character.mining_obs.create(
+                obs_id=obs_id, obs_type="moon", name="Moon", sys_name="Jita"
+            )
+            for obs_id in [1, 2]
+        ]
+        day_1 = dt.date(2022, 1, 1)
+        day_3 = dt.date(2022, 1, 3)
+        observers[0].mining_log.create(
+            date=day_3,
+            miner_id=1001,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            quantity=10,
+            updated_at=now() - dt.timedelta(hours=1),
+        )
+        AdminMiningObsLog.objects.add_to_mining_ledgers()
+        observers[1].mining_log.create(
+            date=day_1,
+            miner_id=1001,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            quantity=50,
+        )
+        # when
+        AdminMiningObsLog.objects.add_to_mining_ledgers()
+        # then
+        self.assertEqual(
+            dict(character_1001.mining_ledger.values_list("date", "quantity")),
+            {day_1: 50, day_3: 10},
+        )
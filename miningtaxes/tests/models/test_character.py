@@ -3,16 +3,19 @@ import hashlib
 import json
 from unittest.mock import patch
 
+from django.core.cache import cache
 from django.utils.timezone import now
 
 from allianceauth.eveonline.models import EveCharacter
 from app_utils.testing import NoSocketsTestCase
 
-from ...models import OrePrices
+from ...models import Character, CharacterMiningLedgerEntry, OrePrices
 from ..testdata.esi_client_stub import esi_client_stub
 from ..testdata.load_entities import load_entities
 from ..testdata.load_eveuniverse import load_eveuniverse
 from ..utils import (
+    add_auth_character_to_user,
+    add_miningtaxes_character_to_user,
     create_character,
     create_character_update_status,
     create_miningtaxes_character,
@@ -70,6 +73,32 @@ class TestCharacter(NoSocketsTestCase):
         self.assertEqual(monthly_k, month_n)
         self.assertEqual(monthly[monthly_k], 10)
 
+    def test_set_prices(self):
+        n = datetime.date(year=2022, month=1, day=15)
+        character_1001 = create_miningtaxes_character(1001)
+        a = OrePrices(eve_type_id=45511, buy=10, sell=100, updated=n)
+        a.calc_prices()
+        c1 = CharacterMiningLedgerEntry(
+            character=character_1001,
+            date=n,
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+        )
+        c2 = CharacterMiningLedgerEntry(
+            character=character_1001,
+            date=n,
+            quantity=20,
+            eve_type_id=45511,
+            eve_solar_system_id=30002537,
+        )
+        CharacterMiningLedgerEntry.objects._set_prices([c1, c2])
+
+        self.assertEqual(c1.raw_price, 100)
+        self.assertEqual(c1.taxes_owed, 10)
+        self.assertEqual(c2.taxed_value, 200)
+        self.assertEqual(c2.taxes_owed, 20)
+
     def test_tax_credits(self):
         character_1001 = create_miningtaxes_character(1001)
         n = now()
@@ -87,6 +116,121 @@ class TestCharacter(NoSocketsTestCase):
         self.assertEqual(last.month, n.month)
         self.assertEqual(last.day, n.day)
 
+    def test_user_balances(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        user = character_1001.user
+        today = now().date()
+        character_1001.mining_ledger.create(
+            date=today.replace(day=1) - datetime.timedelta(days=1),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=10,
+        )
+        character_1001.mining_ledger.create(
+            date=today,
+            quantity=5,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=5,
+        )
+        character_1001.give_credit(4, "paid")
+        # when
+        with self.assertNumQueries(1):
+            user2taxes = Character.objects.user_balances()
+        # then
+        self.assertEqual(user2taxes[user][0], 6)
+        self.assertEqual(user2taxes[user][1], 10)
+        self.assertEqual(user2taxes[user][2], character_1001)
+
+    def test_user_balance(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        user = character_1001.user
+        today = now().date()
+        character_1001.mining_ledger.create(
+            date=today.replace(day=1) - datetime.timedelta(days=1),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=10,
+        )
+        character_1001.mining_ledger.create(
+            date=today,
+            quantity=5,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=5,
+        )
+        character_1001.give_credit(4, "paid")
+        # when
+        balance = Character.objects.user_balance(user)
+        # then
+        self.assertEqual(balance["taxes_due"], 6)
+        self.assertEqual(balance["balance"], 11)
+        self.assertEqual(balance["last_paid"], character_1001.last_paid())
+        with self.assertNumQueries(1):
+            self.assertEqual(Character.objects.user_balance(user), balance)
+        character_1001.give_credit(6, "paid")
+        self.assertEqual(Character.objects.user_balance(user)["taxes_due"], 0)
+
+    def test_with_owner_graph(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        add_miningtaxes_character_to_user(character_1001.user, 1002)
+        # when
+        characters = list(Character.objects.with_owner_graph().order_by("pk"))
+        # then
+        with self.assertNumQueries(0):
+            self.assertEqual(characters[0].user, character_1001.user)
+            self.assertEqual(characters[1].main_character.character_id, 1001)
+            self.assertTrue(characters[0].is_main)
+            self.assertFalse(characters[1].is_main)
+
+    def test_lifetime_totals(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        # when/then
+        self.assertEqual(character_1001.get_lifetime_taxes(), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(character_1001.get_lifetime_taxes(), 0)
+        character_1001.mining_ledger.create(
+            date=now().date(),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=10,
+        )
+        character_1001.tax_credits.create(date=now(), credit=4)
+        character_1001.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertEqual(character_1001.get_lifetime_taxes(), 10)
+            self.assertEqual(character_1001.get_lifetime_credits(), 4)
+
+    def test_resolve_character_ids(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        add_auth_character_to_user(character_1001.user, 1002)
+        character_1121 = create_character(EveCharacter.objects.get(character_id=1121))
+        # when
+        with self.assertNumQueries(2):
+            resolved = Character.objects.resolve_character_ids(
+                [1001, 1002, 1121, 999999]
+            )
+        # then
+        self.assertEqual(resolved[1001].name, "Bruce Wayne")
+        self.assertEqual(resolved[1001].category, "found")
+        self.assertEqual(resolved[1001].character, character_1001)
+        self.assertEqual(resolved[1002].name, "Clark Kent")
+        self.assertEqual(resolved[1002].category, "unregistered")
+        self.assertEqual(resolved[1002].main.character_id, 1001)
+        self.assertEqual(resolved[1002].character, character_1001)
+        self.assertEqual(resolved[1121].category, "unregistered")
+        self.assertEqual(resolved[1121].character, character_1121)
+        self.assertEqual(resolved[999999].category, "unknown")
+        self.assertIsNone(resolved[999999].character)
+
     @patch(MODELS_PATH + ".character.esi")
     def test_get_ledger(self, mock_esi):
         mock_esi.client = esi_client_stub
@@ -101,6 +245,91 @@ class TestCharacter(NoSocketsTestCase):
         self.assertEqual(entry.eve_type_id, 62586)
         self.assertEqual(entry.eve_solar_system_id, 30002537)
 
+    @patch(MODELS_PATH + ".character.esi")
+    def test_get_ledger_unchanged(self, mock_esi):
+        mock_esi.client = esi_client_stub
+        character_1001 = create_miningtaxes_character(1001)
+        character_1001.update_mining_ledger()
+        character_1001.mining_ledger.all().delete()
+        character_1001.update_mining_ledger()
+        self.assertEqual(character_1001.mining_ledger.count(), 0)
+
+    @patch(MODELS_PATH + ".character.esi_results_if_modified")
+    def test_get_ledger_should_not_store_etag_when_saving_fails(
+        self, mock_esi_results_if_modified
+    ):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        etag_key = "miningtaxes-etag-mining-ledger-1001"
+        cache.delete(etag_key)
+        mock_esi_results_if_modified.return_value = (
+            [
+                {
+                    "date": "2022-01-01",
+                    "quantity": 10,
+                    "solar_system_id": 30000142,
+                    "type_id": 1230,
+                }
+            ],
+            "abc",
+        )
+        # when
+        with patch(
+            MODELS_PATH + ".CharacterMiningLedgerEntry.objects.bulk_upsert",
+            side_effect=RuntimeError,
+        ):
+            with self.assertRaises(RuntimeError):
+                character_1001.update_mining_ledger()
+        # then
+        self.assertIsNone(cache.get(etag_key))
+        character_1001.update_mining_ledger()
+        self.assertEqual(cache.get(etag_key), "abc")
+        self.assertEqual(character_1001.mining_ledger.count(), 1)
+
+    def test_bulk_upsert(self):
+        n = datetime.date(year=2022, month=1, day=15)
+        character_1001 = create_miningtaxes_character(1001)
+        OrePrices(eve_type_id=45511, buy=10, sell=100, updated=now()).calc_prices()
+        key = (n, 30002537, 45511)
+        created = CharacterMiningLedgerEntry.objects.bulk_upsert(
+            character_1001, {key: 10}
+        )
+        unchanged = CharacterMiningLedgerEntry.objects.bulk_upsert(
+            character_1001, {key: 10}
+        )
+        updated = CharacterMiningLedgerEntry.objects.bulk_upsert(
+            character_1001, {key: 30}
+        )
+        entry = character_1001.mining_ledger.get()
+
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(unchanged), 0)
+        self.assertEqual(len(updated), 1)
+        self.assertEqual(entry.quantity, 30)
+        self.assertEqual(entry.raw_price, 300)
+        self.assertEqual(entry.taxes_owed, 30)
+
+    def test_bulk_upsert_should_price_unpriced_entries(self):
+        n = datetime.date(year=2022, month=1, day=15)
+        character_1001 = create_miningtaxes_character(1001)
+        key = (n, 30002537, 45511)
+        CharacterMiningLedgerEntry.objects.bulk_upsert(character_1001, {key: 10})
+        unpriced = CharacterMiningLedgerEntry.objects.bulk_upsert(
+            character_1001, {key: 10}
+        )
+        OrePrices(eve_type_id=45511, buy=10, sell=100, updated=now()).calc_prices()
+        # when
+        priced = CharacterMiningLedgerEntry.objects.bulk_upsert(
+            character_1001, {key: 10}
+        )
+        # then
+        entry = character_1001.mining_ledger.get()
+        self.assertEqual(len(unpriced), 0)
+        self.assertEqual(len(priced), 1)
+        self.assertEqual(entry.raw_price, 100)
+        self.assertEqual(entry.taxes_owed, 10)
+        self.assertEqual(character_1001.monthly_summaries.get().taxes_owed, 10)
+
 
 class TestCharacterUpdateStatus(NoSocketsTestCase):
     @classmethod
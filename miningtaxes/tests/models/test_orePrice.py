@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.utils.timezone import now
 from eveuniverse.models import EveType, EveTypeMaterial
 
@@ -6,6 +8,8 @@ from app_utils.testing import NoSocketsTestCase
 from ...models import OrePrices, Settings, get_price, get_tax, ore_calc_prices
 from ..testdata.load_eveuniverse import load_eveuniverse
 
+MODELS_PATH = "miningtaxes.models.orePrices"
+
 
 class TestOrePrice(NoSocketsTestCase):
     @classmethod
@@ -83,7 +87,35 @@ class TestOrePrice(NoSocketsTestCase):
         self.assertEqual(prices[1], 10.8756)
         self.assertEqual(prices[2], 200)
 
+    def test_calc_all_prices(self):
+        n = now()
+        b = EveType(eve_group_id=1920, id=16635, published=True, portion_size=1)
+        b.save()
+        EveTypeMaterial(
+            eve_type_id=45511, material_eve_type_id=16635, quantity=3
+        ).save()
+        OrePrices(eve_type_id=16635, buy=2000, sell=200, updated=n).save()
+        OrePrices(eve_type_id=45511, buy=10, sell=100, updated=n).save()
+        OrePrices(eve_type_id=45503, buy=30, sell=100, updated=n).save()
+        with self.assertNumQueries(4):
+            self.assertEqual(OrePrices.objects.calc_prices(), 3)
+        a = OrePrices.objects.get(eve_type_id=45511)
+        self.assertEqual(a.raw_price, 10)
+        self.assertEqual(a.refined_price, 54.378)  # 0.9063 x 3 x 2000 / 100
+        self.assertEqual(a.taxed_price, 54.378)
+        a = OrePrices.objects.get(eve_type_id=45503)
+        self.assertEqual(a.refined_price, 30)
+        self.assertEqual(a.taxed_price, 30)
+
+    def test_get_tax_should_use_given_settings(self):
+        settings = Settings(tax_R64=25)
+        a = EveType.objects.get(id=45511)
+        with patch(MODELS_PATH + ".Settings.load") as mock_load:
+            self.assertEqual(get_tax(a, settings), 0.25)
+        self.assertFalse(mock_load.called)
+
     def test_get_tax_rates(self):
+        self.addCleanup(Settings.clear_cache)
         s = Settings.load()
         s.tax_R64 = 90
         s.tax_R32 = 80
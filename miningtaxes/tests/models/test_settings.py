@@ -0,0 +1,29 @@
+from app_utils.testing import NoSocketsTestCase
+
+from ...models import Settings
+
+
+class TestSettings(NoSocketsTestCase):
+    def setUp(self) -> None:
+        Settings.clear_cache()
+        self.addCleanup(Settings.clear_cache)
+
+    def test_should_load_settings_only_once(self):
+        # given
+        Settings.load()
+        # when/then
+        with self.assertNumQueries(0):
+            settings = Settings.load()
+        self.assertEqual(settings.pk, 1)
+        self.assertEqual(settings.tax_R64, 10.0)
+
+    def test_should_see_saved_changes(self):
+        # given
+        settings = Settings.load()
+        # when
+        settings.tax_R64 = 50.0
+        settings.save()
+        # then
+        with self.assertNumQueries(0):
+            self.assertEqual(Settings.load().tax_R64, 50.0)
+        self.assertEqual(Settings.objects.get(pk=1).tax_R64, 50.0)
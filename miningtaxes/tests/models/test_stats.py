@@ -0,0 +1,80 @@
+import datetime as dt
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from app_utils.testing import NoSocketsTestCase
+
+from ...models import Stats
+from ..testdata.load_entities import load_entities
+from ..testdata.load_eveuniverse import load_eveuniverse
+from ..utils import create_miningtaxes_character
+
+
+class TestStats(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def test_calc_admin_char_json(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        character_1001.mining_ledger.create(
+            date=dt.date(2022, 1, 15),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=10,
+        )
+        character_1001.give_credit(4, "paid")
+        stats = Stats.load()
+        # when
+        with CaptureQueriesContext(connection) as one_character:
+            stats.calc_admin_char_json()
+        # then
+        self.assertEqual(len(stats.admin_char_json), 1)
+        self.assertEqual(stats.admin_char_json[0]["taxes"], 10)
+        self.assertEqual(stats.admin_char_json[0]["credits"], 4)
+        self.assertEqual(stats.admin_char_json[0]["balance"], 6)
+
+        # when
+        create_miningtaxes_character(1002)
+        with CaptureQueriesContext(connection) as two_characters:
+            stats.calc_admin_char_json()
+        # then
+        self.assertEqual(len(stats.admin_char_json), 2)
+        self.assertEqual(len(two_characters), len(one_character))
+
+    def test_calc_admin_main_json(self):
+        # given
+        character_1001 = create_miningtaxes_character(1001)
+        character_1001.mining_ledger.create(
+            date=dt.date(2022, 1, 15),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=10,
+        )
+        character_1001.give_credit(4, "paid")
+        stats = Stats.load()
+        # when
+        with CaptureQueriesContext(connection) as one_character:
+            stats.calc_admin_main_json()
+        # then
+        self.assertEqual(len(stats.admin_main_json), 1)
+        self.assertEqual(stats.admin_main_json[0]["balance"], 6)
+        self.assertEqual(
+            stats.admin_main_json[0]["last_paid"],
+            str(character_1001.last_paid()),
+        )
+
+        # when
+        character_1002 = create_miningtaxes_character(1002)
+        character_1002.give_credit(2, "paid")
+        with CaptureQueriesContext(connection) as two_characters:
+            stats.calc_admin_main_json()
+        # then
+        self.assertEqual(len(stats.admin_main_json), 2)
+        self.assertEqual(len(two_characters), len(one_character))
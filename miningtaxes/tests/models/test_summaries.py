@@ -0,0 +1,257 @@
+import datetime as dt
+from unittest.mock import patch
+
+from django.utils.timezone import make_aware
+
+from app_utils.testing import NoSocketsTestCase
+
+from ...models import (
+    CharacterMiningLedgerEntry,
+    CharacterMonthlySummary,
+    OrePrices,
+    Stats,
+    SystemMonthlySummary,
+)
+from ...models.summaries import SystemMonthlySummaryManager, rebuild_summaries
+from ..testdata.load_entities import load_entities
+from ..testdata.load_eveuniverse import load_eveuniverse
+from ..utils import create_miningtaxes_character
+
+
+class TestSummaries(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def setUp(self) -> None:
+        self.character = create_miningtaxes_character(1001)
+        OrePrices(
+            eve_type_id=45511, buy=10, sell=100, updated=dt.datetime.now()
+        ).calc_prices()
+
+    def test_should_update_summaries_on_upsert(self):
+        # when
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character,
+            {
+                (dt.date(2022, 1, 15), 30000142, 45511): 10,
+                (dt.date(2022, 1, 20), 30000142, 45511): 20,
+                (dt.date(2022, 2, 1), 30002537, 45511): 5,
+            },
+        )
+        # then
+        january = self.character.monthly_summaries.get(month=dt.date(2022, 1, 1))
+        self.assertEqual(january.quantity, 30)
+        self.assertEqual(january.taxed_value, 300)
+        self.assertEqual(january.taxes_owed, 30)
+        system = SystemMonthlySummary.objects.get(
+            eve_solar_system_id=30000142, month=dt.date(2022, 1, 1)
+        )
+        self.assertEqual(system.tax_group, "R64")
+        self.assertEqual(system.quantity, 30)
+        self.assertEqual(system.first_date, dt.date(2022, 1, 15))
+        self.assertEqual(SystemMonthlySummary.objects.count(), 2)
+
+    def test_should_update_summaries_on_changed_quantity(self):
+        # given
+        key = (dt.date(2022, 1, 15), 30000142, 45511)
+        CharacterMiningLedgerEntry.objects.bulk_upsert(self.character, {key: 10})
+        # when
+        CharacterMiningLedgerEntry.objects.bulk_upsert(self.character, {key: 15})
+        # then
+        summary = CharacterMonthlySummary.objects.get(character=self.character)
+        self.assertEqual(summary.quantity, 15)
+        self.assertEqual(summary.taxes_owed, 15)
+
+    def test_should_overwrite_summary_created_concurrently(self):
+        # given
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character, {(dt.date(2022, 1, 15), 30000142, 45511): 10}
+        )
+        SystemMonthlySummary.objects.all().delete()
+        calc_totals = SystemMonthlySummaryManager._totals
+
+        def insert_before_calc(manager, *args):
+            SystemMonthlySummary.objects.create(
+                eve_solar_system_id=30000142,
+                tax_group="R64",
+                month=dt.date(2022, 1, 1),
+                quantity=3,
+                first_date=dt.date(2022, 1, 2),
+            )
+            return calc_totals(manager, *args)
+
+        # when
+        with patch.object(
+            SystemMonthlySummaryManager,
+            "_totals",
+            autospec=True,
+            side_effect=insert_before_calc,
+        ):
+            SystemMonthlySummary.objects.refresh([(30000142, dt.date(2022, 1, 15))])
+        # then
+        system = SystemMonthlySummary.objects.get()
+        self.assertEqual(system.quantity, 10)
+        self.assertEqual(system.first_date, dt.date(2022, 1, 15))
+
+    def test_should_update_summaries_on_credit(self):
+        # when
+        self.character.give_credit(1234, "paid")
+        # then
+        summary = CharacterMonthlySummary.objects.get(character=self.character)
+        self.assertEqual(summary.credits, 1234)
+        self.assertEqual(summary.quantity, 0)
+
+    def test_should_only_refresh_credits_of_given_months(self):
+        # given
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character, {(dt.date(2022, 1, 15), 30000142, 45511): 10}
+        )
+        self.character.tax_credits.create(
+            date=make_aware(dt.datetime(2022, 1, 31, 23, 0)),
+            credit=5,
+            credit_type="paid",
+        )
+        self.character.tax_credits.create(
+            date=make_aware(dt.datetime(2022, 2, 1, 0, 0)), credit=7, credit_type="paid"
+        )
+        CharacterMonthlySummary.objects.update(credits=0)
+        # when
+        CharacterMonthlySummary.objects.refresh(
+            [(self.character.pk, dt.date(2022, 1, 1))]
+        )
+        # then
+        january = self.character.monthly_summaries.get(month=dt.date(2022, 1, 1))
+        self.assertEqual(january.credits, 5)
+        february = self.character.monthly_summaries.get(month=dt.date(2022, 2, 1))
+        self.assertEqual(february.credits, 0)
+
+    def test_should_serve_leaderboards_from_summaries(self):
+        # given
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character, {(dt.date(2022, 1, 15), 30000142, 45511): 10}
+        )
+        stats = Stats.load()
+        # when
+        stats.calc_leaderboards()
+        # then
+        self.assertEqual(
+            stats.leaderboards["data"],
+            [
+                {
+                    "month": "2022-01-01",
+                    "table": [
+                        {
+                            "rank": 1,
+                            "character": "Bruce Wayne",
+                            "amount": 100.0,
+                        }
+                    ],
+                }
+            ],
+        )
+
+    def test_should_serve_dashboards_from_summaries(self):
+        # given
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character, {(dt.date(2022, 1, 15), 30000142, 45511): 10}
+        )
+        stats = Stats.load()
+        # when
+        stats.calc_admin_month_json()
+        stats.calc_admin_mining_by_sys_json()
+        # then
+        self.assertEqual(stats.admin_month_json["xdata"][1], "2022-01-01")
+        self.assertEqual(stats.admin_month_json["ydata"][0][1], 10)
+        self.assertEqual(
+            stats.admin_mining_by_sys_json["tables"]["2022-01"]["Jita"]["R64"],
+            {"tax": 10, "isk": 100},
+        )
+
+    def test_should_update_summaries_on_deleted_entry(self):
+        # given
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character,
+            {
+                (dt.date(2022, 1, 15), 30000142, 45511): 10,
+                (dt.date(2022, 1, 20), 30000142, 45511): 20,
+            },
+        )
+        # when
+        self.character.mining_ledger.get(date=dt.date(2022, 1, 20)).delete()
+        # then
+        summary = CharacterMonthlySummary.objects.get(character=self.character)
+        self.assertEqual(summary.quantity, 10)
+        system = SystemMonthlySummary.objects.get(eve_solar_system_id=30000142)
+        self.assertEqual(system.quantity, 10)
+
+    def test_should_update_system_summaries_on_deleted_character(self):
+        # given
+        other = create_miningtaxes_character(1002)
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character, {(dt.date(2022, 1, 15), 30000142, 45511): 10}
+        )
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            other,
+            {
+                (dt.date(2022, 1, 16), 30000142, 45511): 5,
+                (dt.date(2022, 2, 1), 30002537, 45511): 7,
+            },
+        )
+        # when
+        other.delete()
+        # then
+        system = SystemMonthlySummary.objects.get()
+        self.assertEqual(system.eve_solar_system_id, 30000142)
+        self.assertEqual(system.quantity, 10)
+        self.assertEqual(system.first_date, dt.date(2022, 1, 15))
+
+    def test_should_update_system_summaries_on_cascaded_character(self):
+        # given
+        other = create_miningtaxes_character(1002)
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            other, {(dt.date(2022, 1, 16), 30000142, 45511): 5}
+        )
+        # when
+        other.eve_character.delete()
+        # then
+        self.assertFalse(SystemMonthlySummary.objects.exists())
+
+    def test_should_update_summaries_on_bulk_deleted_credits(self):
+        # given
+        self.character.give_credit(1234, "paid")
+        self.character.give_credit(66, "paid")
+        # when
+        self.character.tax_credits.filter(credit=1234).delete()
+        # then
+        summary = CharacterMonthlySummary.objects.get(character=self.character)
+        self.assertEqual(summary.credits, 66)
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.life_credits, 66)
+
+    def test_should_rebuild_all_summaries(self):
+        # given
+        CharacterMiningLedgerEntry.objects.bulk_upsert(
+            self.character, {(dt.date(2022, 1, 15), 30000142, 45511): 10}
+        )
+        self.character.give_credit(1234, "paid")
+        CharacterMonthlySummary.objects.all().delete()
+        SystemMonthlySummary.objects.update(quantity=99)
+        SystemMonthlySummary.objects.create(
+            eve_solar_system_id=30002537,
+            tax_group="R64",
+            month=dt.date(2022, 2, 1),
+            quantity=5,
+            first_date=dt.date(2022, 2, 1),
+        )
+        # when
+        rebuild_summaries()
+        # then
+        january = self.character.monthly_summaries.get(month=dt.date(2022, 1, 1))
+        self.assertEqual(january.quantity, 10)
+        self.assertEqual(self.character.monthly_summaries.count(), 2)
+        system = SystemMonthlySummary.objects.get()
+        self.assertEqual(system.eve_solar_system_id, 30000142)
+        self.assertEqual(system.quantity, 10)
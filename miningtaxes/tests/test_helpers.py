@@ -0,0 +1,38 @@
+from app_utils.testing import NoSocketsTestCase
+
+from ..helpers import PriceGroups
+from .testdata.load_eveuniverse import load_eveuniverse
+
+
+class TestPriceGroups(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self) -> None:
+        PriceGroups.invalidate()
+
+    def test_should_index_types_by_tax_group(self):
+        # when
+        pg = PriceGroups.load()
+        # then
+        self.assertEqual(pg.type_taxgroups[45511], "R64")  # Monazite
+        self.assertEqual(pg.type_taxgroups[1230], "Ores")  # Veldspar
+        self.assertIn(45511, pg.moon_ore_type_ids)
+        self.assertNotIn(1230, pg.moon_ore_type_ids)
+
+    def test_should_build_registry_only_once(self):
+        # given
+        pg = PriceGroups.load()
+        # when/then
+        with self.assertNumQueries(0):
+            self.assertIs(PriceGroups.load(), pg)
+
+    def test_should_rebuild_registry_when_invalidated(self):
+        # given
+        pg = PriceGroups.load()
+        # when
+        PriceGroups.invalidate()
+        # then
+        self.assertIsNot(PriceGroups.load(), pg)
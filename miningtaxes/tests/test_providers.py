@@ -0,0 +1,176 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock
+from urllib.parse import parse_qs, urlparse
+
+from bravado.exception import HTTPNotModified
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from app_utils.esi_testing import BravadoOperationStub, BravadoResponseStub
+from app_utils.testing import NoSocketsTestCase
+
+from ..providers import (
+    FuzzworkPriceProvider,
+    JanicePriceProvider,
+    MarketPrice,
+    esi_results_if_modified,
+    price_provider,
+    store_etag,
+)
+
+
+class TestEsiResultsIfModified(NoSocketsTestCase):
+    def setUp(self) -> None:
+        cache.delete("test-etag")
+
+    def test_should_store_etag_and_send_it_on_next_call(self):
+        # given
+        method = Mock(
+            return_value=BravadoOperationStub([1, 2], headers={"ETag": "abc"})
+        )
+        # when
+        results, etag = esi_results_if_modified(method, "test-etag", corporation_id=1)
+        esi_results_if_modified(method, "test-etag", corporation_id=1)
+        store_etag("test-etag", etag)
+        esi_results_if_modified(method, "test-etag", corporation_id=1)
+        # then
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(etag, "abc")
+        self.assertNotIn("_request_options", method.call_args_list[0].kwargs)
+        self.assertNotIn("_request_options", method.call_args_list[1].kwargs)
+        self.assertEqual(
+            method.call_args_list[2].kwargs["_request_options"],
+            {"headers": {"If-None-Match": "abc"}},
+        )
+
+    def test_should_return_none_when_not_modified(self):
+        # given
+        cache.set("test-etag", "abc")
+        operation = Mock()
+        operation.results.side_effect = HTTPNotModified(
+            response=BravadoResponseStub(304)
+        )
+        method = Mock(return_value=operation)
+        # when
+        results, etag = esi_results_if_modified(method, "test-etag", corporation_id=1)
+        # then
+        self.assertIsNone(results)
+        self.assertIsNone(etag)
+
+
+class PricingApiStub(BaseHTTPRequestHandler):
+    """Answers like the Fuzzwork and Janice APIs and fails the first request."""
+
+    requests = []
+    failures = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _fail_once(self) -> bool:
+        if self.failures > 0:
+            type(self).failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return True
+        return False
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.requests.append(url.path)
+        if self._fail_once():
+            return
+        type_ids = parse_qs(url.query)["types"][0].split(",")
+        self._send_json(
+            {
+                type_id: {"buy": {"max": "10.5"}, "sell": {"min": "20"}}
+                for type_id in type_ids
+            }
+        )
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.requests.append(url.path)
+        if self._fail_once():
+            return
+        length = int(self.headers["Content-Length"])
+        type_ids = self.rfile.read(length).decode().split("\n")
+        self._send_json(
+            [
+                {
+                    "itemType": {"eid": int(type_id)},
+                    "top5AveragePrices": {
+                        "buyPrice5DayMedian": 10.5,
+                        "sellPrice5DayMedian": 20,
+                    },
+                }
+                for type_id in type_ids
+            ]
+        )
+
+
+class TestPriceProviders(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PricingApiStub)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        PricingApiStub.requests = []
+        PricingApiStub.failures = 0
+
+    def test_should_fetch_fuzzwork_prices_in_chunks(self):
+        # given
+        provider = FuzzworkPriceProvider(base_url=self.base_url, concurrency=2)
+        provider.chunk_size = 2
+        # when
+        prices = provider.get_prices([1, 2, 3, 4, 5])
+        # then
+        self.assertEqual(len(PricingApiStub.requests), 3)
+        self.assertEqual(set(prices.keys()), {1, 2, 3, 4, 5})
+        self.assertEqual(prices[3], MarketPrice(buy=10.5, sell=20.0))
+
+    def test_should_fetch_janice_prices(self):
+        # given
+        provider = JanicePriceProvider(base_url=self.base_url, api_key="dummy")
+        # when
+        prices = provider.get_prices([1, 2])
+        # then
+        self.assertEqual(PricingApiStub.requests, ["/api/rest/v2/pricer"])
+        self.assertEqual(
+            prices, {1: MarketPrice(10.5, 20.0), 2: MarketPrice(10.5, 20.0)}
+        )
+
+    def test_should_retry_failed_requests(self):
+        # given
+        PricingApiStub.failures = 1
+        provider = FuzzworkPriceProvider(base_url=self.base_url, backoff_factor=0)
+        # when
+        prices = provider.get_prices([1])
+        # then
+        self.assertEqual(len(PricingApiStub.requests), 2)
+        self.assertEqual(prices, {1: MarketPrice(10.5, 20.0)})
+
+    def test_should_return_provider_for_method(self):
+        self.assertIsInstance(price_provider("Janice"), JanicePriceProvider)
+        with self.assertRaises(ValueError):
+            price_provider("Unknown")
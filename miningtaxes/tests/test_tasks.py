@@ -0,0 +1,189 @@
+from unittest.mock import patch
+
+from celery import current_app
+
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from app_utils.testing import NoSocketsTestCase
+
+from .. import tasks
+from ..models import Character, OrePrices, StaticDataFingerprint
+from ..providers import MarketPrice
+from .testdata.load_entities import load_entities
+from .testdata.load_eveuniverse import load_eveuniverse
+from .utils import create_miningtaxes_admincharacter, create_miningtaxes_character
+
+TASKS_PATH = "miningtaxes.tasks"
+
+
+class PriceProviderStub:
+    def is_available(self):
+        return True
+
+    def get_prices(self, type_ids):
+        return {type_id: MarketPrice(buy=10.5, sell=20.0) for type_id in type_ids}
+
+
+@patch(TASKS_PATH + ".EveTypeMaterial.objects.update_or_create_api")
+@patch(TASKS_PATH + ".EveType.objects.update_or_create_esi")
+@patch(TASKS_PATH + ".price_provider", new=PriceProviderStub)
+class TestUpdateAllPrices(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+
+    def test_should_create_and_update_prices(self, *args):
+        # given
+        OrePrices.objects.create(eve_type_id=45511, buy=1, sell=2, updated=now())
+        # when
+        tasks.update_all_prices()
+        # then
+        ore = OrePrices.objects.get(eve_type_id=45511)
+        self.assertEqual(ore.buy, 10)
+        self.assertEqual(ore.sell, 20)
+        self.assertEqual(ore.raw_price, 10)
+        self.assertTrue(OrePrices.objects.filter(eve_type_id=62586).exists())
+
+    def test_should_load_static_data_only_once(self, mock_update_or_create_esi, *args):
+        # when
+        tasks.update_all_prices()
+        calls = mock_update_or_create_esi.call_count
+        tasks.update_all_prices()
+        # then
+        self.assertGreater(calls, 0)
+        self.assertEqual(mock_update_or_create_esi.call_count, calls)
+        self.assertEqual(StaticDataFingerprint.objects.count(), calls)
+
+    def test_should_reload_static_data_when_forced(
+        self, mock_update_or_create_esi, *args
+    ):
+        # given
+        tasks.update_static_data()
+        calls = mock_update_or_create_esi.call_count
+        # when
+        tasks.update_static_data(force_update=True)
+        # then
+        self.assertEqual(mock_update_or_create_esi.call_count, 2 * calls)
+
+
+@patch(TASKS_PATH + ".MININGTAXES_UPDATE_CHUNK_SIZE", 1)
+@patch(TASKS_PATH + ".MININGTAXES_UPDATE_CONCURRENCY", 2)
+@patch(TASKS_PATH + ".Stats")
+@patch(TASKS_PATH + ".add_tax_credits")
+@patch(TASKS_PATH + ".add_corp_moon_taxes")
+@patch(TASKS_PATH + ".update_character")
+@patch(TASKS_PATH + ".update_admin_character")
+@patch(TASKS_PATH + ".update_all_prices")
+class TestUpdateDaily(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def setUp(self) -> None:
+        always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        self.addCleanup(setattr, current_app.conf, "task_always_eager", always_eager)
+        create_miningtaxes_admincharacter(1003)
+        self.characters = [
+            create_miningtaxes_character(character_id)
+            for character_id in [1001, 1002, 1101]
+        ]
+
+    def test_should_run_all_stages(
+        self,
+        mock_update_all_prices,
+        mock_update_admin_character,
+        mock_update_character,
+        mock_add_corp_moon_taxes,
+        mock_add_tax_credits,
+        mock_stats,
+    ):
+        # when
+        tasks.update_daily.delay()
+        # then
+        self.assertTrue(mock_update_admin_character.called)
+        self.assertEqual(mock_update_character.call_count, 3)
+        self.assertTrue(mock_add_corp_moon_taxes.called)
+        self.assertTrue(mock_add_tax_credits.called)
+        self.assertTrue(mock_stats.load.return_value.precalc_all.called)
+
+    def test_should_finish_when_updates_fail(
+        self,
+        mock_update_all_prices,
+        mock_update_admin_character,
+        mock_update_character,
+        mock_add_corp_moon_taxes,
+        mock_add_tax_credits,
+        mock_stats,
+    ):
+        # given
+        mock_update_admin_character.side_effect = RuntimeError
+        mock_update_character.side_effect = RuntimeError
+        mock_add_corp_moon_taxes.side_effect = RuntimeError
+        # when
+        tasks.update_daily.delay()
+        # then
+        self.assertEqual(mock_update_character.call_count, 3)
+        self.assertTrue(mock_add_tax_credits.called)
+        self.assertTrue(mock_stats.load.return_value.precalc_all.called)
+
+    def test_should_run_serially(
+        self,
+        mock_update_all_prices,
+        mock_update_admin_character,
+        mock_update_character,
+        mock_add_corp_moon_taxes,
+        mock_add_tax_credits,
+        mock_stats,
+    ):
+        # when
+        tasks.update_daily_serial()
+        # then
+        self.assertEqual(mock_update_character.call_count, 3)
+        self.assertTrue(mock_stats.load.return_value.precalc_all.called)
+
+    def test_should_finish_when_a_chunk_fails(
+        self,
+        mock_update_all_prices,
+        mock_update_admin_character,
+        mock_update_character,
+        mock_add_corp_moon_taxes,
+        mock_add_tax_credits,
+        mock_stats,
+    ):
+        # given
+        no_characters = Character.objects.none()
+        # when
+        with patch(TASKS_PATH + ".Character.objects.filter") as mock_filter:
+            mock_filter.side_effect = [no_characters, no_characters, RuntimeError]
+            tasks.update_daily.delay()
+        # then
+        self.assertEqual(mock_filter.call_count, 3)
+        self.assertTrue(mock_stats.load.return_value.precalc_all.called)
+
+    def test_should_give_up_stuck_stage(
+        self,
+        mock_update_all_prices,
+        mock_update_admin_character,
+        mock_update_character,
+        mock_add_corp_moon_taxes,
+        mock_add_tax_credits,
+        mock_stats,
+    ):
+        # given
+        cache.set("miningtaxes-daily-stage-test", 1)
+        # when
+        tasks.check_stage(
+            stage_key="miningtaxes-daily-stage-test",
+            next_task=tasks.precalc_stats.si(),
+        )
+        tasks.finish_stage(
+            stage_key="miningtaxes-daily-stage-test",
+            next_task=tasks.precalc_stats.si(),
+        )
+        # then
+        self.assertEqual(mock_stats.load.return_value.precalc_all.call_count, 1)
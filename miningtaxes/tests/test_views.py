@@ -0,0 +1,224 @@
+import datetime as dt
+import json
+
+from dateutil.relativedelta import relativedelta
+
+from django.test import RequestFactory
+from django.utils.timezone import now
+
+from allianceauth.tests.auth_utils import AuthUtils
+from app_utils.testing import NoSocketsTestCase
+
+from .. import views
+from .testdata.load_entities import load_entities
+from .testdata.load_eveuniverse import load_eveuniverse
+from .utils import add_miningtaxes_character_to_user, create_miningtaxes_character
+
+
+class TestAllActivity(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        character = create_miningtaxes_character(1001)
+        self.user = AuthUtils.add_permission_to_user_by_name(
+            "miningtaxes.auditor_access", character.user
+        )
+        for day in range(1, 4):
+            character.mining_ledger.create(
+                date=dt.date(2022, 1, day),
+                quantity=10 * day,
+                eve_type_id=45511,
+                eve_solar_system_id=30000142,
+                taxed_value=100 * day,
+                taxes_owed=10 * day,
+            )
+
+    def test_should_return_page_of_activity(self):
+        # given
+        request = self.factory.get(
+            "/",
+            {
+                "draw": 3,
+                "start": 1,
+                "length": 1,
+                "order[0][column]": 6,
+                "order[0][dir]": "asc",
+                "search[value]": "jita",
+            },
+        )
+        request.user = self.user
+        # when
+        response = views.admin_all_activity_data(request)
+        # then
+        data = json.loads(response.content)
+        self.assertEqual(data["draw"], 3)
+        self.assertEqual(data["recordsTotal"], 3)
+        self.assertEqual(data["recordsFiltered"], 3)
+        self.assertEqual(
+            data["data"],
+            [
+                [
+                    "2022-01-02",
+                    "Jita",
+                    "Bruce Wayne",
+                    "Bruce Wayne",
+                    "Monazite",
+                    "R64",
+                    20,
+                    200.0,
+                    20.0,
+                ]
+            ],
+        )
+
+    def test_should_search_activity_by_main(self):
+        # given
+        alt = add_miningtaxes_character_to_user(self.user, 1002)
+        alt.mining_ledger.create(
+            date=dt.date(2022, 1, 5),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+        )
+        request = self.factory.get("/", {"search[value]": "bruce"})
+        request.user = self.user
+        # when
+        response = views.admin_all_activity_data(request)
+        # then
+        data = json.loads(response.content)
+        self.assertEqual(data["recordsFiltered"], 4)
+        self.assertEqual(data["data"][0][2], alt.eve_character.character_name)
+
+    def test_should_cache_total_until_ledger_changes(self):
+        # given
+        request = self.factory.get("/")
+        request.user = self.user
+        views.admin_all_activity_data(request)
+        # when
+        with self.assertNumQueries(1):
+            response = views.admin_all_activity_data(request)
+        # then
+        self.assertEqual(json.loads(response.content)["recordsTotal"], 3)
+        # when
+        self.user.profile.main_character.miningtaxes_character.mining_ledger.create(
+            date=dt.date(2022, 1, 5),
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+        )
+        response = views.admin_all_activity_data(request)
+        # then
+        self.assertEqual(json.loads(response.content)["recordsTotal"], 4)
+
+    def test_should_stream_activity_as_csv(self):
+        # given
+        request = self.factory.get("/")
+        request.user = self.user
+        # when
+        response = views.admin_all_activity_csv(request)
+        # then
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("Date,Sys,Character"))
+        self.assertTrue(lines[1].startswith("2022-01-03,Jita"))
+
+
+class TestExportData(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        character = create_miningtaxes_character(1001)
+        self.user = AuthUtils.add_permission_to_user_by_name(
+            "miningtaxes.auditor_access", character.user
+        )
+        for day in range(1, 4):
+            character.mining_ledger.create(
+                date=dt.date(2022, 1, day),
+                quantity=10 * day,
+                eve_type_id=45511,
+                eve_solar_system_id=30000142,
+            )
+
+    def _export(self, dataset, **params):
+        request = self.factory.get("/", params)
+        request.user = self.user
+        return views.export_data(request, dataset)
+
+    def test_should_stream_csv_in_date_range(self):
+        # when
+        response = self._export("character_ledger", start="2022-01-02")
+        # then
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("date,character,corporation"))
+        self.assertTrue(lines[1].startswith("2022-01-02,Bruce Wayne"))
+
+    def test_should_stream_ndjson(self):
+        # when
+        response = self._export("character_ledger", format="ndjson", end="2022-01-01")
+        # then
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["date"], "2022-01-01")
+        self.assertEqual(rows[0]["quantity"], 10)
+
+    def test_should_filter_by_corporation(self):
+        # when
+        response = self._export("character_ledger", corporation_id=2099)
+        # then
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+
+    def test_should_reject_invalid_filter(self):
+        # when
+        response = self._export("corp_ledger", start="yesterday")
+        # then
+        self.assertEqual(response.status_code, 400)
+
+    def test_should_return_404_for_unknown_dataset(self):
+        # when
+        response = self._export("unknown")
+        # then
+        self.assertEqual(response.status_code, 404)
+
+
+class TestSummaryMonthJson(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_eveuniverse()
+        load_entities()
+
+    def test_should_return_monthly_taxes_of_characters(self):
+        # given
+        character = create_miningtaxes_character(1001)
+        this_month = now().date().replace(day=1)
+        last_month = this_month - relativedelta(months=1)
+        character.mining_ledger.create(
+            date=last_month,
+            quantity=10,
+            eve_type_id=45511,
+            eve_solar_system_id=30000142,
+            taxes_owed=10,
+        )
+        request = RequestFactory().get("/")
+        request.user = character.user
+        # when
+        response = views.summary_month_json(request, character.user.pk)
+        # then
+        data = json.loads(response.content)
+        self.assertEqual(data["xdata"], ["x", str(last_month), str(this_month)])
+        self.assertEqual(data["ydata"], [["Bruce Wayne", 10.0, 0.0]])
@@ -51,15 +51,21 @@ urlpatterns = [
         name="summary_month_json",
     ),
     path(
-        "admin_get_all_activity_json",
-        views.admin_get_all_activity_json,
-        name="admin_get_all_activity_json",
+        "admin_all_activity_data",
+        views.admin_all_activity_data,
+        name="admin_all_activity_data",
+    ),
+    path(
+        "admin_all_activity_csv",
+        views.admin_all_activity_csv,
+        name="admin_all_activity_csv",
     ),
     path(
         "all_tax_credits/<int:user_pk>",
         views.all_tax_credits,
         name="all_tax_credits",
     ),
+    path("export/<str:dataset>", views.export_data, name="export_data"),
     path("faq", views.faq, name="faq"),
     path("ore_prices", views.ore_prices, name="ore_prices"),
     path("ore_prices_json", views.ore_prices_json, name="ore_prices_json"),
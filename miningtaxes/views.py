@@ -1,18 +1,26 @@
+import csv
 import datetime as dt
+import itertools
+import json
 
 from dateutil.relativedelta import relativedelta
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
+from django.db.models import Q
 from django.http import (
     HttpResponse,
     HttpResponseForbidden,
     HttpResponseNotFound,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.dateparse import parse_date
 from django.utils.html import format_html
 from django.utils.timezone import now
 
@@ -28,10 +36,133 @@ from app_utils.views import bootstrap_icon_plus_name_html
 from . import __title__, __version__, tasks
 from .forms import SettingsForm
 from .helpers import PriceGroups
-from .models import AdminCharacter, AdminMiningObsLog, Character, Settings, Stats
+from .models import (
+    AdminCharacter,
+    AdminMiningCorpLedgerEntry,
+    AdminMiningObsLog,
+    Character,
+    CharacterMiningLedgerEntry,
+    CharacterMonthlySummary,
+    Settings,
+    Stats,
+)
+from .models.character import ledger_version
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
+ALL_ACTIVITY_COLUMNS = (
+    ("Date", "date"),
+    ("Sys", "system_name"),
+    ("Character", "character_name"),
+    ("Main", "main_name"),
+    ("Ore", "type_name"),
+    ("Group", None),
+    ("Amount", "quantity"),
+    ("ISK Value", "taxed_value"),
+    ("Taxed", "taxes_owed"),
+)
+"""Columns of the all activity table with the field used for sorting them."""
+
+ALL_ACTIVITY_PAGE_SIZE_MAX = 1000
+
+ALL_ACTIVITY_TOTAL_TIMEOUT = 3600
+"""Seconds the total count of the all activity table is cached for a ledger version,
+which also limits how long changed character ownerships are missed."""
+
+
+class Echo:
+    """File-like object, which returns what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(filename: str, rows) -> StreamingHttpResponse:
+    """Stream rows as CSV file without building it in memory."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows), content_type="text/csv"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def streaming_ndjson_response(filename: str, names, rows) -> StreamingHttpResponse:
+    """Stream rows as newline delimited JSON objects with the given names."""
+    response = StreamingHttpResponse(
+        (
+            json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + "\n"
+            for row in rows
+        ),
+        content_type="application/x-ndjson",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+EXPORTS = {
+    "character_ledger": {
+        "queryset": lambda: CharacterMiningLedgerEntry.objects.all(),
+        "date": "date",
+        "corporation": "character__eve_character__corporation_id",
+        "columns": (
+            ("date", "date"),
+            ("character", "character__eve_character__character_name"),
+            ("corporation", "character__eve_character__corporation_name"),
+            ("solar_system", "eve_solar_system__name"),
+            ("ore", "eve_type__name"),
+            ("quantity", "quantity"),
+            ("raw_price", "raw_price"),
+            ("refined_price", "refined_price"),
+            ("taxed_value", "taxed_value"),
+            ("taxes_owed", "taxes_owed"),
+        ),
+    },
+    "observer_logs": {
+        "queryset": lambda: AdminMiningObsLog.objects.all(),
+        "date": "date",
+        "corporation": "observer__character__eve_character__corporation_id",
+        "columns": (
+            ("date", "date"),
+            ("corporation", "observer__character__eve_character__corporation_name"),
+            ("observer", "observer__name"),
+            ("solar_system", "eve_solar_system__name"),
+            ("miner_id", "miner_id"),
+            ("ore", "eve_type__name"),
+            ("quantity", "quantity"),
+        ),
+    },
+    "corp_ledger": {
+        "queryset": lambda: AdminMiningCorpLedgerEntry.objects.all(),
+        "date": "date__date",
+        "corporation": "character__eve_character__corporation_id",
+        "columns": (
+            ("date", "date"),
+            ("corporation", "character__eve_character__corporation_name"),
+            ("taxed_id", "taxed_id"),
+            ("amount", "amount"),
+            ("reason", "reason"),
+        ),
+    },
+}
+"""Datasets available for export with their filters and columns."""
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _all_activity_row(entry: dict, pg: PriceGroups) -> list:
+    return [
+        str(entry["date"]),
+        entry["system_name"],
+        entry["character_name"],
+        entry["main_name"],
+        entry["type_name"],
+        pg.type_taxgroups.get(entry["eve_type_id"], ""),
+        entry["quantity"],
+        entry["taxed_value"],
+        entry["taxes_owed"],
+    ]
+
 
 @login_required
 @permission_required("miningtaxes.admin_access")
@@ -49,7 +180,7 @@ def admin_launcher(request):
     else:
         form = SettingsForm(instance=settings)
 
-    admin_query = AdminCharacter.objects.all()
+    admin_query = AdminCharacter.objects.with_owner_graph()
     auth_characters = list()
     for a_character in admin_query:
         eve_character = a_character.eve_character
@@ -65,7 +196,7 @@ def admin_launcher(request):
             }
         )
 
-    registered = Character.objects.all()
+    registered = Character.objects.with_owner_graph()
     auth_registered = list()
     for a_character in registered:
         eve_character = a_character.eve_character
@@ -123,7 +254,7 @@ def admin_tables(request):
             )
         else:
             user = User.objects.get(pk=int(request.POST["userid"]))
-            characters = Character.objects.owned_by_user(user)
+            characters = Character.objects.owned_by_user(user).with_owner_graph()
             suitable = None
             for c in characters:
                 if c.is_main:
@@ -181,7 +312,6 @@ def index(request):
 @login_required
 @permission_required("miningtaxes.basic_access")
 def user_summary(request, user_pk: int):
-    s = Stats.load()
     user = User.objects.get(pk=user_pk)
     owned_chars_query = (
         EveCharacter.objects.filter(character_ownership__user=user)
@@ -201,8 +331,8 @@ def user_summary(request, user_pk: int):
             auth_characters.append(character)
     unregistered_chars = sorted(unregistered_chars)
     main_character_id = user.profile.main_character.character_id
-    main_data, _, user2taxes = s.main_data_helper(auth_characters)
-    taxes_due = user2taxes[user][0]
+    balance = Character.objects.user_balance(user)
+    taxes_due = balance["taxes_due"]
     if taxes_due < 0:
         taxes_due = 0
 
@@ -211,10 +341,10 @@ def user_summary(request, user_pk: int):
         "auth_characters": auth_characters,
         "unregistered_chars": unregistered_chars,
         "main_character_id": main_character_id,
-        "balance": humanize_number(main_data[list(main_data.keys())[0]]["balance"]),
-        "balance_raw": main_data[list(main_data.keys())[0]]["balance"],
+        "balance": humanize_number(balance["balance"]),
+        "balance_raw": balance["balance"],
         "taxes_due": taxes_due,
-        "last_paid": main_data[list(main_data.keys())[0]]["last_paid"],
+        "last_paid": balance["last_paid"],
         "user_pk": user_pk,
     }
     return render(request, "miningtaxes/user_summary.html", context)
@@ -222,9 +352,72 @@ def user_summary(request, user_pk: int):
 
 @login_required
 @permission_required("miningtaxes.auditor_access")
-def admin_get_all_activity_json(request):
-    s = Stats.load()
-    return JsonResponse({"data": s.get_admin_get_all_activity_json()})
+def admin_all_activity_data(request):
+    """Page of all mining activity for a DataTables table
+    with server-side processing.
+    """
+    try:
+        draw = int(request.GET.get("draw", 0))
+        start = max(0, int(request.GET.get("start", 0)))
+        length = int(request.GET.get("length", 10))
+        order_column = int(request.GET.get("order[0][column]", 0))
+    except ValueError:
+        return HttpResponse(status=400)
+    if length < 0 or length > ALL_ACTIVITY_PAGE_SIZE_MAX:
+        length = ALL_ACTIVITY_PAGE_SIZE_MAX
+    entries = CharacterMiningLedgerEntry.objects.activity()
+    records_total = cache.get_or_set(
+        f"miningtaxes-all-activity-total-{ledger_version()}",
+        entries.count,
+        timeout=ALL_ACTIVITY_TOTAL_TIMEOUT,
+    )
+    search = request.GET.get("search[value]", "").strip()
+    if search:
+        entries = entries.filter(
+            Q(eve_solar_system__name__icontains=search)
+            | Q(character__eve_character__character_name__icontains=search)
+            | Q(main_name__icontains=search)
+            | Q(eve_type__name__icontains=search)
+        )
+        records_filtered = entries.count()
+    else:
+        records_filtered = records_total
+    try:
+        order_field = ALL_ACTIVITY_COLUMNS[order_column][1] or "date"
+    except IndexError:
+        order_field = "date"
+    if request.GET.get("order[0][dir]", "desc") == "desc":
+        order_field = "-" + order_field
+    pg = PriceGroups.load()
+    data = [
+        _all_activity_row(entry, pg)
+        for entry in entries.order_by(order_field, "-id")[start : start + length]
+    ]
+    return JsonResponse(
+        {
+            "draw": draw,
+            "recordsTotal": records_total,
+            "recordsFiltered": records_filtered,
+            "data": data,
+        }
+    )
+
+
+@login_required
+@permission_required("miningtaxes.auditor_access")
+def admin_all_activity_csv(request):
+    """All mining activity as CSV file streamed from the database."""
+    pg = PriceGroups.load()
+    entries = (
+        CharacterMiningLedgerEntry.objects.activity()
+        .order_by("-date", "-id")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    rows = itertools.chain(
+        [[name for name, _ in ALL_ACTIVITY_COLUMNS]],
+        (_all_activity_row(entry, pg) for entry in entries),
+    )
+    return streaming_csv_response("miningtaxes-allactivity.csv", rows)
 
 
 @login_required
@@ -268,21 +461,30 @@ def summary_month_json(request, user_pk: int):
     user = User.objects.get(pk=user_pk)
     if request.user != user and not request.user.has_perm("miningtaxes.auditor_access"):
         return HttpResponseForbidden()
-    characters = Character.objects.owned_by_user(user)
-    monthly = list(map(lambda x: x.get_monthly_taxes(), characters))
+    characters = list(
+        Character.objects.owned_by_user(user).select_related("eve_character")
+    )
+    monthly = [{} for _ in characters]
+    index = {character.pk: i for i, character in enumerate(characters)}
+    for character_pk, month, taxes_owed in CharacterMonthlySummary.objects.filter(
+        character__in=characters, quantity__gt=0
+    ).values_list("character_id", "month", "taxes_owed"):
+        monthly[index[character_pk]][month] = taxes_owed
     firstmonth = None
     for entries in monthly:
         if len(entries.keys()) == 0:
             continue
-        if firstmonth is None or firstmonth > sorted(entries.keys())[0]:
-            firstmonth = sorted(entries.keys())[0]
+        if firstmonth is None or firstmonth > min(entries.keys()):
+            firstmonth = min(entries.keys())
+    lastmonth = dt.date(now().year, now().month, 1)
+    if firstmonth is None:
+        firstmonth = lastmonth
     xs = None
     ys = []
     for i, entries in enumerate(monthly):
         y = [characters[i].name]
         x = ["x"]
         curmonth = firstmonth
-        lastmonth = dt.date(now().year, now().month, 1)
         while curmonth <= lastmonth:
             if curmonth not in entries:
                 entries[curmonth] = 0.0
@@ -577,7 +779,7 @@ def user_mining_ledger_90day(request, user_pk: int) -> JsonResponse:
     if request.user != user and not request.user.has_perm("miningtaxes.auditor_access"):
         return HttpResponseForbidden()
     characters = Character.objects.owned_by_user(user)
-    pg = PriceGroups()
+    pg = PriceGroups.load()
     allpgs = {}
     alldays = {}
     polar = {}
@@ -585,7 +787,7 @@ def user_mining_ledger_90day(request, user_pk: int) -> JsonResponse:
         ledger = c.get_90d_mining()
         for entry in ledger:
             try:
-                g = pg.taxgroups[entry.eve_type.eve_group_id]
+                g = pg.type_taxgroups[entry.eve_type_id]
                 allpgs[g] = [g]
                 v = entry.taxed_value
             except Exception as e:
@@ -631,3 +833,47 @@ def user_mining_ledger_90day(request, user_pk: int) -> JsonResponse:
             "days": [["days mined", days]],
         }
     )
+
+
+@login_required
+@permission_required("miningtaxes.auditor_access")
+def export_data(request, dataset: str):
+    """Stream a dataset as CSV or NDJSON file.
+
+    Query parameters:
+    - format: csv (default) or ndjson
+    - start, end: Only include rows from this date range (YYYY-MM-DD)
+    - corporation_id: Only include rows of this corporation
+    """
+    try:
+        export = EXPORTS[dataset]
+    except KeyError:
+        return HttpResponseNotFound()
+    output_format = request.GET.get("format", "csv")
+    if output_format not in ("csv", "ndjson"):
+        return HttpResponse("Unknown format", status=400)
+    filters = {}
+    try:
+        for param, lookup in (("start", "gte"), ("end", "lte")):
+            if request.GET.get(param):
+                date = parse_date(request.GET[param])
+                if date is None:
+                    raise ValueError(param)
+                filters[f"{export['date']}__{lookup}"] = date
+        if request.GET.get("corporation_id"):
+            filters[export["corporation"]] = int(request.GET["corporation_id"])
+    except ValueError:
+        return HttpResponse("Invalid filter", status=400)
+
+    names = [name for name, _ in export["columns"]]
+    rows = (
+        export["queryset"]()
+        .filter(**filters)
+        .order_by("date", "pk")
+        .values_list(*[lookup for _, lookup in export["columns"]])
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    filename = f"miningtaxes-{dataset}.{output_format}"
+    if output_format == "ndjson":
+        return streaming_ndjson_response(filename, names, rows)
+    return streaming_csv_response(filename, itertools.chain([names], rows))